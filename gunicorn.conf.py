@@ -0,0 +1,148 @@
+# Gunicorn settings for production, picked up by `gunicorn wsgi --chdir ./src/ -c gunicorn.conf.py`.
+#
+# Everything can be overridden from the environment:
+#   WEB_WORKER_CLASS        sync | gthread (default) | gevent
+#   WEB_CONCURRENCY         worker processes; by default derived from CPUs and memory
+#   WEB_THREADS             threads per gthread worker (default 4)
+#   WEB_WORKER_CONNECTIONS  concurrent requests per gevent worker (default 100)
+#   WEB_WORKER_MEMORY_MB    memory budgeted per worker when sizing (default 120)
+#   WEB_PRELOAD             import the app once in the master (default true, false for gevent)
+#   WEB_TIMEOUT, WEB_GRACEFUL_TIMEOUT, WEB_KEEPALIVE, WEB_MAX_REQUESTS, WEB_MAX_REQUESTS_JITTER
+#
+# The measured throughput of each worker class is in the README ("Running in production").
+
+import os
+import shutil
+import sys
+import tempfile
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+
+def env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+def available_cpus():
+    """CPUs this process may use: the cgroup quota of the container if there is one, else the affinity mask."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    for quota_file, period_file in (('/sys/fs/cgroup/cpu.max', None),
+                                    ('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', '/sys/fs/cgroup/cpu/cpu.cfs_period_us')):
+        try:
+            with open(quota_file) as f:
+                values = f.read().split()
+            if period_file is not None:
+                with open(period_file) as f:
+                    values.append(f.read().strip())
+        except OSError:
+            continue
+        if values[0] not in ('max', '-1'):
+            return max(1, min(cpus, int(int(values[0]) / int(values[1]))))
+        break
+    return cpus
+
+
+def available_memory_mb():
+    """Memory limit of the container (cgroup v2 or v1), else the physical memory of the machine."""
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2 ** 20
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value != 'max':
+            return min(physical, int(value) // 2 ** 20)
+    return physical
+
+
+def default_workers(worker_class, cpus, memory_mb, worker_memory_mb):
+    # sync workers block on every query, so they oversubscribe the CPUs; threaded and
+    # cooperative workers already overlap I/O inside each process
+    by_cpu = {'sync': 2 * cpus + 1, 'gthread': cpus + 1, 'gevent': cpus}[worker_class]
+    # leave room for the master and the rest of the container
+    by_memory = max(1, (memory_mb - 64) // worker_memory_mb)
+    return max(1, min(by_cpu, by_memory))
+
+
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+if worker_class not in WORKER_CLASSES:
+    sys.exit('WEB_WORKER_CLASS debe ser uno de: {}'.format(', '.join(WORKER_CLASSES)))
+if worker_class == 'gevent':
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        sys.exit('WEB_WORKER_CLASS=gevent requiere instalar gevent (y psycogreen con Postgres)')
+
+cpus = available_cpus()
+memory_mb = available_memory_mb()
+workers = int(os.getenv('WEB_CONCURRENCY') or default_workers(
+    worker_class, cpus, memory_mb, int(os.getenv('WEB_WORKER_MEMORY_MB', 120))))
+threads = int(os.getenv('WEB_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.getenv('WEB_WORKER_CONNECTIONS', 100))
+
+# every thread of a worker may hold a connection; size the pool to match unless set explicitly
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+
+# gevent patches the standard library when the worker starts, after a preloaded app already
+# imported it, so it loads the app in each worker instead
+preload_app = env_bool('WEB_PRELOAD', worker_class != 'gevent')
+# long enough for big pages; streamed exports need gthread or gevent, a sync worker is killed
+# when one request outlives the timeout
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+# idle seconds a client connection is kept open for the next request
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+# recycle workers now and then to cap slow leaks; the jitter keeps them from restarting together
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', max_requests // 10))
+# heartbeat files on tmpfs, so a slow disk can't make the master think a worker hung
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# directories made for this master, removed again when it exits
+created_dirs = []
+
+# with several workers /metrics has to add up every worker's snapshot (see src/metrics.py);
+# one directory per master so a restart doesn't count the previous deploy
+if workers > 1 and 'METRICS_DIR' not in os.environ:
+    os.environ['METRICS_DIR'] = os.path.join(tempfile.gettempdir(), 'api-metrics-{}'.format(os.getpid()))
+    created_dirs.append(os.environ['METRICS_DIR'])
+
+accesslog = os.getenv('WEB_ACCESS_LOG') or None
+
+
+def on_starting(server):
+    server.log.info('%s workers x %s (%s threads, %s connections) for %s CPUs and %s MB, preload=%s',
+                    workers, worker_class, threads, worker_connections, cpus, memory_mb, preload_app)
+    server.log.info('cache: CACHE_BACKEND=%s', os.getenv('CACHE_BACKEND', 'memory'))
+    # the memory tier is per worker, so each one fills its own copy; ENTITY_CACHE_SIZE=0 turns it
+    # off (the benchmark does), nothing to share then
+    if workers > 1 and os.getenv('CACHE_BACKEND', 'memory') == 'memory' and os.getenv('ENTITY_CACHE_SIZE') != '0':
+        server.log.warning('CACHE_BACKEND=memory with %s workers: every worker keeps its own cache, so each '
+                           'entry is loaded and stored up to %s times. Set CACHE_BACKEND=redis to share one',
+                           workers, workers)
+
+
+def on_exit(server):
+    for directory in created_dirs:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            pass
+    # with preload_app the engines were created in the master; drop the pooled connections
+    # each worker inherited (without closing them, they belong to the parent) so it opens its own
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        with app_module.app.app_context():
+            for engine in app_module.db.engines.values():
+                engine.dispose(close=False)
@@ -0,0 +1,58 @@
+"""search_index for /search (FTS5 on SQLite, tsvector + GIN on Postgres)
+
+Revision ID: 37274813eb8e
+Revises: aa8d1cecc061
+Create Date: 2026-10-18 12:20:05.118240
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '37274813eb8e'
+down_revision = 'aa8d1cecc061'
+branch_labels = None
+depends_on = None
+
+# rows are keyed id * 4 + code so the handlers can replace them by primary key
+SOURCES = [('planets', 'planet', 1), ('characters', 'character', 2), ('vehicles', 'vehicle', 3)]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE search_index USING fts5("
+            "name, entity UNINDEXED, entity_id UNINDEXED, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        for table, entity, code in SOURCES:
+            op.execute(
+                "INSERT INTO search_index (rowid, name, entity, entity_id) "
+                "SELECT id * 4 + {}, COALESCE(name, ''), '{}', id FROM {}".format(code, entity, table)
+            )
+    elif dialect == 'postgresql':
+        op.create_table('search_index',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('entity', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.Text(), nullable=False),
+        sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_search_index_document', 'search_index', ['document'], postgresql_using='gin')
+        for table, entity, code in SOURCES:
+            op.execute(
+                "INSERT INTO search_index (id, entity, entity_id, name, document) "
+                "SELECT id * 4 + {}, '{}', id, COALESCE(name, ''), to_tsvector('simple', COALESCE(name, '')) FROM {}".format(code, entity, table)
+            )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('DROP TABLE search_index')
+    elif dialect == 'postgresql':
+        op.drop_index('ix_search_index_document', table_name='search_index')
+        op.drop_table('search_index')
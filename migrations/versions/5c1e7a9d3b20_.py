@@ -0,0 +1,34 @@
+"""(column, id) indexes for the sortable columns
+
+Revision ID: 5c1e7a9d3b20
+Revises: 9f68294217f5
+Create Date: 2026-10-18 16:02:44.118309
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e7a9d3b20'
+down_revision = '9f68294217f5'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_planets_population_id', 'planets', ['population', 'id']),
+    ('ix_characters_height_id', 'characters', ['height', 'id']),
+    ('ix_characters_mass_id', 'characters', ['mass', 'id']),
+    ('ix_vehicles_type_id', 'vehicles', ['type', 'id']),
+    ('ix_favorite_user_id_id', 'favorite', ['user_id', 'id']),
+)
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,36 @@
+"""favorite_count counters for /favorites/top
+
+Revision ID: 9f68294217f5
+Revises: 37274813eb8e
+Create Date: 2026-10-18 13:41:26.502184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f68294217f5'
+down_revision = '37274813eb8e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('favorite_count',
+    sa.Column('type', sa.String(length=20), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('type', 'item_id')
+    )
+    op.create_index('ix_favorite_count_top', 'favorite_count', ['type', 'count', 'item_id'], unique=False)
+    for type, column in (('planet', 'planet_id'), ('vehicle', 'vehicles_id'), ('character', 'characters_id')):
+        op.execute(
+            "INSERT INTO favorite_count (type, item_id, count) "
+            "SELECT '{0}', {1}, COUNT(*) FROM favorite WHERE {1} IS NOT NULL GROUP BY {1}".format(type, column)
+        )
+
+
+def downgrade():
+    op.drop_index('ix_favorite_count_top', table_name='favorite_count')
+    op.drop_table('favorite_count')
@@ -0,0 +1,43 @@
+"""indexes and per-type uniqueness for favorites
+
+Revision ID: aa8d1cecc061
+Revises: d2b29353aeb2
+Create Date: 2026-10-18 11:02:47.913305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'aa8d1cecc061'
+down_revision = 'd2b29353aeb2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep the oldest copy of each duplicated favorite so the unique indexes can be built
+    # (the derived table lets MySQL delete from the table it reads)
+    op.execute(
+        'DELETE FROM favorite WHERE id NOT IN ('
+        'SELECT id FROM (SELECT MIN(id) AS id FROM favorite '
+        'GROUP BY user_id, planet_id, vehicles_id, characters_id) AS keep)'
+    )
+    op.create_index('uq_favorite_user_planet', 'favorite', ['user_id', 'planet_id'], unique=True)
+    op.create_index('uq_favorite_user_vehicle', 'favorite', ['user_id', 'vehicles_id'], unique=True)
+    op.create_index('uq_favorite_user_character', 'favorite', ['user_id', 'characters_id'], unique=True)
+    op.create_index(op.f('ix_favorite_planet_id'), 'favorite', ['planet_id'], unique=False)
+    op.create_index(op.f('ix_favorite_vehicles_id'), 'favorite', ['vehicles_id'], unique=False)
+    op.create_index(op.f('ix_favorite_characters_id'), 'favorite', ['characters_id'], unique=False)
+    op.create_index(op.f('ix_characters_planet_id'), 'characters', ['planet_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_characters_planet_id'), table_name='characters')
+    op.drop_index(op.f('ix_favorite_characters_id'), table_name='favorite')
+    op.drop_index(op.f('ix_favorite_vehicles_id'), table_name='favorite')
+    op.drop_index(op.f('ix_favorite_planet_id'), table_name='favorite')
+    op.drop_index('uq_favorite_user_character', table_name='favorite')
+    op.drop_index('uq_favorite_user_vehicle', table_name='favorite')
+    op.drop_index('uq_favorite_user_planet', table_name='favorite')
@@ -0,0 +1,33 @@
+"""table_version counters for ETags
+
+Revision ID: d2b29353aeb2
+Revises: 2b2da04fc990
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b29353aeb2'
+down_revision = '2b2da04fc990'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_version = op.create_table('table_version',
+    sa.Column('name', sa.String(length=40), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_version, [
+        {'name': 'planets', 'version': 0},
+        {'name': 'characters', 'version': 0},
+        {'name': 'vehicles', 'version': 0},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_version')
@@ -1,19 +1,95 @@
 import os
-from flask_admin import Admin
-from models import db, User,Planet,Character,Vehicle,Favorite
-from flask_admin.contrib.sqla import ModelView
+import threading
+from collections import Counter
+from flask import Flask
+import search
+from models import db, User, Planet, Character, Vehicle, Favorite, FavoriteCount
+
+
+class SyncedWrites:
+    """Flask-Admin hooks that keep search_index and favorite_count in step with the admin's edits, as
+    the API handlers do. They run before the admin commits, so both move in its transaction.
+    """
+
+    def on_model_change(self, form, model, is_created):
+        if isinstance(model, Favorite):
+            deltas = Counter()
+            if not is_created:
+                # the stored row still names the old item; without autoflush the edit isn't written yet
+                with self.session.no_autoflush:
+                    old = self.session.query(Favorite.planet_id, Favorite.vehicles_id, Favorite.characters_id).filter_by(id=model.id).one()
+                deltas[FavoriteCount.item(old)] -= 1
+            # the form sets relationships; the flush fills in the id columns
+            self.session.flush()
+            deltas[FavoriteCount.item(model)] += 1
+            deltas.pop(None, None)
+            FavoriteCount.change(deltas)
+        elif type(model) in (Planet, Character, Vehicle):
+            self.session.flush()
+            search.index(search.entity_of(type(model)), model.id, model.name)
+
+    def on_model_delete(self, model):
+        if isinstance(model, Favorite):
+            item = FavoriteCount.item(model)
+            if item is not None:
+                FavoriteCount.change({item: -1})
+        elif type(model) in (Planet, Character, Vehicle):
+            entity = search.entity_of(type(model))
+            search.remove(entity, model.id)
+            FavoriteCount.forget(entity, model.id)
+
 
 def setup_admin(app):
+    # Flask-Admin is imported here so workers that never serve /admin don't pay for it
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+    class CatalogView(SyncedWrites, ModelView):
+        pass
+
     # Add your models here, for example this is how we add a the User model to the admin
     admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Planet, db.session))
-    admin.add_view(ModelView(Character, db.session))
-    admin.add_view(ModelView(Vehicle, db.session))
-    admin.add_view(ModelView(Favorite, db.session))
+    # catalog and favorite edits also update the search index and the favorite counters
+    admin.add_view(CatalogView(Planet, db.session))
+    admin.add_view(CatalogView(Character, db.session))
+    admin.add_view(CatalogView(Vehicle, db.session))
+    admin.add_view(CatalogView(Favorite, db.session))
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
+
+class LazyAdmin:
+    """WSGI middleware that builds the admin on the first request under /admin.
+
+    Routes can't be added to a Flask app once it has served a request, so the admin lives in its
+    own small app with the same config and database, and requests for /admin are dispatched to it.
+    """
+
+    def __init__(self, app, init_engine=None):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.init_engine = init_engine
+        self.admin_app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == '/admin' or path.startswith('/admin/'):
+            return self.get_admin_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def get_admin_app(self):
+        with self._lock:
+            if self.admin_app is None:
+                admin_app = Flask(self.app.import_name)
+                admin_app.config.update(self.app.config)
+                admin_app.url_map.strict_slashes = False
+                db.init_app(admin_app)
+                if self.init_engine is not None:
+                    self.init_engine(admin_app, db)
+                setup_admin(admin_app)
+                self.admin_app = admin_app
+        return self.admin_app
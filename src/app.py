@@ -2,17 +2,42 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+from collections import Counter
+import click
 from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User,Planet,Character,Vehicle,Favorite
-#from models import Person
+from sqlalchemy.exc import IntegrityError
+from utils import APIException, generate_sitemap, paginate, wants_stream, stream_json, stream_export, conditional, cached_page, cache_key, SparseFields
+from admin import setup_admin, LazyAdmin
+from models import db, User, Planet, Character, Vehicle, Favorite, TableVersion, FavoriteCount, CHARACTER_LOAD, FAVORITE_LOAD
+from cache import entity_cache
+from metrics import metrics
+from compression import compression
+from query_detector import query_detector
+from database import engine_options, init_engine, get_pool_stats
+import search
+import stats
+from json_provider import init_json
+from seed import seed_command
+# from models import Person
+
+FAVORITE_TYPES = {
+    'planet': ('planet_id', Planet),
+    'vehicle': ('vehicles_id', Vehicle),
+    'character': ('characters_id', Character),
+}
+
+# resources served by /export/<resource>; user is left out on purpose (passwords)
+EXPORTS = {
+    'planets': Planet,
+    'characters': Character,
+    'vehicles': Vehicle,
+    'favorites': Favorite,
+}
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+init_json(app)
 
 db_url = os.getenv("DATABASE_URL")
 if db_url is not None:
@@ -20,11 +45,142 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['API_DEFAULT_PAGE_SIZE'] = int(os.getenv("API_DEFAULT_PAGE_SIZE", 100))
+app.config['API_MAX_PAGE_SIZE'] = int(os.getenv("API_MAX_PAGE_SIZE", 1000))
+app.config['API_STREAM_BATCH_SIZE'] = int(os.getenv("API_STREAM_BATCH_SIZE", 500))
+# eager: mount Flask-Admin at import; lazy: build it on the first /admin request; off: no admin
+app.config['ADMIN'] = os.getenv("ADMIN", "lazy")
+
+# Flask-Migrate pulls in Alembic, which only the `flask db ...` commands need; the flask CLI
+# imports this module inside a click context, gunicorn and the test client don't
+MIGRATE = None
+if click.get_current_context(silent=True) is not None:
+    from flask_migrate import Migrate
+    MIGRATE = Migrate(app, db, include_object=search.include_object)
 db.init_app(app)
+init_engine(app, db)
 CORS(app)
-setup_admin(app)
+metrics.init_app(app)
+compression.init_app(app)
+query_detector.init_app(app, db)
+if app.config['ADMIN'] == 'eager':
+    setup_admin(app)
+elif app.config['ADMIN'] == 'lazy':
+    app.wsgi_app = LazyAdmin(app, init_engine)
+
+def is_int(value):
+    # JSON true/false arrive as bool, which is an int subclass
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def is_optional_int(value):
+    return value is None or is_int(value)
+
+def is_text(value, column):
+    # non-blank string that fits the column
+    return isinstance(value, str) and value.strip() != '' and len(value) <= column.type.length
+
+def text_error(name, column):
+    return '{} debe ser un texto de 1 a {} caracteres'.format(name, column.type.length)
+
+def planet_row(item):
+    if not isinstance(item, dict) or "name" not in item:
+        return None, 'Debes proporcionar el nombre del planeta'
+    if not is_text(item['name'], Planet.name):
+        return None, text_error('name', Planet.name)
+    if not is_optional_int(item.get('population')):
+        return None, 'population debe ser un entero'
+    return {'name': item['name'], 'population': item.get('population')}, None
+
+def character_row(item):
+    if not isinstance(item, dict) or "name" not in item or "planet_id" not in item:
+        return None, 'Debes proporcionar  el nombre del personaje y el ID del planeta de donde viene'
+    if not is_text(item['name'], Character.name):
+        return None, text_error('name', Character.name)
+    # every character belongs to a planet; only height and mass may be null
+    if not all(is_optional_int(item.get(field)) for field in ('height', 'mass')) or not is_int(item['planet_id']):
+        return None, 'height, mass y planet_id deben ser enteros'
+    return {'name': item['name'], 'height': item.get('height'), 'mass': item.get('mass'), 'planet_id': item['planet_id']}, None
+
+def vehicle_row(item):
+    if not isinstance(item, dict) or "name" not in item or "type" not in item:
+        return None, 'Debes proporcionar el nombre del vehículo y el tipo'
+    for field in ('name', 'type'):
+        if not is_text(item[field], getattr(Vehicle, field)):
+            return None, text_error(field, getattr(Vehicle, field))
+    return {'name': item['name'], 'type': item['type']}, None
+
+def planet_error(planet_id):
+    if db.session.query(Planet.id).filter_by(id=planet_id).first() is None:
+        return 'El planeta {} no existe'.format(planet_id)
+    return None
+
+def update_error(body, model, texts=(), ints=()):
+    """First invalid field of a PUT body, with the same rules as the create validators."""
+    if not isinstance(body, dict):
+        return 'Debes enviar un objeto en el body'
+    for field in texts:
+        if field in body and not is_text(body[field], getattr(model, field)):
+            return text_error(field, getattr(model, field))
+    for field in ints:
+        if field in body and not is_optional_int(body[field]):
+            return '{} debe ser un entero'.format(field)
+    return None
+
+def query_in_chunks(columns, filter_column, values, *criteria, chunk_size=500):
+    # keeps IN lists under SQLite's bound parameter limit
+    values = list(values)
+    for start in range(0, len(values), chunk_size):
+        yield from db.session.query(*columns).filter(filter_column.in_(values[start:start + chunk_size]), *criteria)
+
+def create_many(model, items, to_row, table):
+    """Validate a JSON array, insert the valid rows with one executemany in a single transaction and report per-item errors."""
+    rows, errors, names = [], [], set()
+    for index, item in enumerate(items):
+        row, error = to_row(item)
+        if error is None and row['name'] in names:
+            error = 'Nombre repetido en el lote'
+        if error is not None:
+            errors.append({'index': index, 'msg': error})
+            continue
+        names.add(row['name'])
+        rows.append((index, row))
+
+    taken = {name for (name,) in query_in_chunks([model.name], model.name, names)}
+    missing_planets = set()
+    if model is Character:
+        planet_ids = {row['planet_id'] for _, row in rows}
+        missing_planets = planet_ids - {id for (id,) in query_in_chunks([Planet.id], Planet.id, planet_ids)}
+
+    valid = []
+    for index, row in rows:
+        if row['name'] in taken:
+            errors.append({'index': index, 'msg': 'Ya existe un registro con el nombre {}'.format(row['name'])})
+        elif row.get('planet_id') in missing_planets:
+            errors.append({'index': index, 'msg': 'El planeta {} no existe'.format(row['planet_id'])})
+        else:
+            valid.append((index, row))
+    errors.sort(key=lambda error: error['index'])
+
+    if not valid:
+        return jsonify({'msg': 'Ningún elemento del lote es válido', 'result': [], 'errors': errors}), 400
+
+    db.session.execute(model.__table__.insert(), [row for _, row in valid])
+    # names are unique on all three catalog tables, so they map the new rows back to their ids
+    ids = dict(query_in_chunks([model.name, model.id], model.name, [row['name'] for _, row in valid]))
+    search.index_many(search.entity_of(model), [(id, name) for name, id in ids.items()])
+    db.session.commit()
+    entity_cache.invalidate((table, '*'))
+
+    created = [{'index': index, 'id': ids[row['name']]} for index, row in valid]
+    return jsonify({'msg': '{} elementos creados'.format(len(created)), 'result': created, 'errors': errors}), 201
+
+def planet_dependency(character):
+    # sparse fieldsets may leave out the planet id, then any planet write invalidates the entry
+    planet = character.get('planet')
+    if planet is not None and 'id' in planet:
+        return ('planets', planet['id'])
+    return ('planets', '*')
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -36,17 +192,40 @@ def handle_invalid_usage(error):
 def sitemap():
     return generate_sitemap(app)
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/db/stats', methods=['GET'])
+def db_stats():
+    return jsonify({'msg': "ok", 'result': get_pool_stats(db.engine)}), 200
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'msg': "ok", 'result': entity_cache.stats()}), 200
+
 @app.route('/user/<int:user_id>', methods=['GET'])
 def handle_hello(user_id):
-    users = User.query.get(user_id)
-    serialized_users= users.serialize()
-    return jsonify({'msg':"ok","result":serialized_users}), 200
+    fields = SparseFields(User)
+    serialized_users = entity_cache.fetch(
+        cache_key(('user',), 'user', user_id, *fields.key()),
+        lambda: fields.get(user_id),
+        depends_on=lambda user: [('user', user_id)],
+    )
+
+    if serialized_users is None:
+        return jsonify({'msg': 'Usuario no encontrado'}), 404
+    return jsonify({'msg': "ok", "result": serialized_users}), 200
 
 @app.route('/user', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    serialized_users = [user.serialize() for user in users]
-    return jsonify({'msg': "ok", 'result': serialized_users}), 200
+    fields = SparseFields(User)
+    query = fields.query()
+    if wants_stream():
+        return stream_json(query, User, fields.row)
+
+    page = cached_page(query, User, fields.row, ('user',))
+    return jsonify({'msg': "ok", 'result': page['result'], 'next': page['next']}), 200
 
 @app.route('/user', methods=['POST'])
 def post_users():
@@ -62,6 +241,7 @@ def post_users():
 
     db.session.add(new_user)
     db.session.commit()
+    entity_cache.invalidate(('user', '*'))
 
     return jsonify({'msg': "Usuario creado exitosamente"}), 200
 
@@ -86,6 +266,7 @@ def update_user(user_id):
         user.is_active = body['is_active']
 
     db.session.commit()
+    entity_cache.invalidate(('user', user_id), ('user', '*'))
 
     return jsonify({'msg': 'Usuario actualizado ', 'user': user.serialize()}), 200
 
@@ -99,28 +280,33 @@ def delete_user(user_id):
 
     db.session.delete(user)
     db.session.commit()
+    entity_cache.invalidate(('user', user_id), ('user', '*'))
 
     return jsonify({'msg': 'Usuario eliminado exitosamente'}), 200
 
 
-
-
-
-
-
-
 @app.route('/planets', methods=['GET'])
+@conditional('planets')
 def get_planets():
-    planets = Planet.query.all()
-    serialized_planets = [planet.serialize() for planet in planets]
-    return jsonify({'msg': "ok", 'result': serialized_planets}), 200
+    fields = SparseFields(Planet)
+    query = fields.query()
+    if wants_stream():
+        return stream_json(query, Planet, fields.row)
+
+    page = cached_page(query, Planet, fields.row, ('planets',))
+    return jsonify({'msg': "ok", 'result': page['result'], 'next': page['next']}), 200
 
 @app.route('/planets/<int:planet_id>', methods=['GET'])
+@conditional('planets')
 def get_planet(planet_id):
-    planet = Planet.query.get(planet_id)
-    
-    if planet:
-        serialized_planet = planet.serialize()
+    fields = SparseFields(Planet)
+    serialized_planet = entity_cache.fetch(
+        cache_key(('planets',), 'planets', planet_id, *fields.key()),
+        lambda: fields.get(planet_id),
+        depends_on=lambda planet: [('planets', planet_id)],
+    )
+
+    if serialized_planet:
         return jsonify({'msg': "ok", 'result': serialized_planet}), 200
     else:
         return jsonify({'msg': "Planet not found", 'result': {}}), 404
@@ -129,13 +315,20 @@ def get_planet(planet_id):
 def create_planet():
     data = request.get_json()
 
-    if not data or "name" not in data:
-        return jsonify({'msg': 'Debes proporcionar el nombre del planeta'}), 400
+    if isinstance(data, list):
+        return create_many(Planet, data, planet_row, 'planets')
+
+    row, error = planet_row(data)
+    if error is not None:
+        return jsonify({'msg': error}), 400
 
-    new_planet = Planet(name=data['name'], population=data.get('population'))
+    new_planet = Planet(**row)
 
     db.session.add(new_planet)
+    db.session.flush()
+    search.index('planet', new_planet.id, new_planet.name)
     db.session.commit()
+    entity_cache.invalidate(('planets', '*'))
 
     return jsonify({'msg': 'Planeta creado exitosamente', 'planet': new_planet.serialize()}), 200
 
@@ -147,6 +340,10 @@ def update_planet(planet_id):
     if body is None:
         return jsonify({'msg': 'Debes enviar información en el body'}), 400
 
+    error = update_error(body, Planet, texts=('name',), ints=('population',))
+    if error is not None:
+        return jsonify({'msg': error}), 400
+
     planet = Planet.query.get(planet_id)
 
     if not planet:
@@ -155,16 +352,16 @@ def update_planet(planet_id):
     # Actualiza los campos si están presentes en el cuerpo de la solicitud
     if "name" in body:
         planet.name = body['name']
+        search.index('planet', planet_id, planet.name)
     if "population" in body:
         planet.population = body['population']
 
     db.session.commit()
+    entity_cache.invalidate(('planets', planet_id), ('planets', '*'))
 
     return jsonify({'msg': 'Planeta actualizado exitosamente', 'planet': planet.serialize()}), 200
 
 
-
-
 @app.route('/planet/<int:planet_id>', methods=['DELETE'])
 def delete_planet(planet_id):
     planet = Planet.query.get(planet_id)
@@ -173,36 +370,36 @@ def delete_planet(planet_id):
         return jsonify({'msg': 'Planeta no encontrado'}), 404
 
     db.session.delete(planet)
+    search.remove('planet', planet_id)
+    FavoriteCount.forget('planet', planet_id)
     db.session.commit()
+    entity_cache.invalidate(('planets', planet_id), ('planets', '*'))
 
     return jsonify({'msg': 'Planeta eliminado exitosamente'}), 200
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
 @app.route('/characters', methods=['GET'])
+@conditional('characters', 'planets')
 def get_characters():
-    characters = Character.query.all()
-    serialized_characters = [character.serialize() for character in characters]
-    return jsonify({'msg': "ok", 'result': serialized_characters}), 200
+    fields = SparseFields(Character)
+    query = fields.query()
+    if wants_stream():
+        return stream_json(query, Character, fields.row)
+
+    page = cached_page(query, Character, fields.row, ('characters', 'planets'))
+    return jsonify({'msg': "ok", 'result': page['result'], 'next': page['next']}), 200
 
 @app.route('/characters/<int:character_id>', methods=['GET'])
+@conditional('characters', 'planets')
 def get_character(character_id):
-    character = Character.query.get(character_id)
-    
-    if character:
-        serialized_character = character.serialize()
+    fields = SparseFields(Character)
+    serialized_character = entity_cache.fetch(
+        cache_key(('characters', 'planets'), 'characters', character_id, *fields.key()),
+        lambda: fields.get(character_id),
+        depends_on=lambda character: [('characters', character_id), planet_dependency(character)],
+    )
+
+    if serialized_character:
         return jsonify({'msg': "ok", 'result': serialized_character}), 200
     else:
         return jsonify({'msg': "Character not found", 'result': {}}), 404
@@ -211,18 +408,25 @@ def get_character(character_id):
 def create_character():
     data = request.get_json()
 
-    if not data or "name" not in data or "planet_id" not in data:
-        return jsonify({'msg': 'Debes proporcionar  el nombre del personaje y el ID del planeta de donde viene'}), 400
+    if isinstance(data, list):
+        return create_many(Character, data, character_row, 'characters')
 
-    new_character = Character(
-        name=data['name'],
-        height=data.get('height'),
-        mass=data.get('mass'),
-        planet_id=data['planet_id']
-    )
+    row, error = character_row(data)
+    if error is not None:
+        return jsonify({'msg': error}), 400
+
+    # same check as create_many runs for every item of a batch
+    error = planet_error(row['planet_id'])
+    if error is not None:
+        return jsonify({'msg': error}), 404
+
+    new_character = Character(**row)
 
     db.session.add(new_character)
+    db.session.flush()
+    search.index('character', new_character.id, new_character.name)
     db.session.commit()
+    entity_cache.invalidate(('characters', '*'))
 
     return jsonify({'msg': 'Personaje creado exitosamente', 'character': new_character.serialize()}), 201
 
@@ -234,7 +438,10 @@ def delete_character(character_id):
         return jsonify({'msg': 'Personaje no encontrado'}), 404
 
     db.session.delete(character)
+    search.remove('character', character_id)
+    FavoriteCount.forget('character', character_id)
     db.session.commit()
+    entity_cache.invalidate(('characters', character_id), ('characters', '*'))
 
     return jsonify({'msg': 'Personaje eliminado exitosamente'}), 200
 
@@ -245,14 +452,26 @@ def update_character(character_id):
     if body is None:
         return jsonify({'msg': 'Debes enviar información en el body'}), 400
 
+    error = update_error(body, Character, texts=('name',), ints=('height', 'mass'))
+    if error is None and 'planet_id' in body and not is_int(body['planet_id']):
+        error = 'planet_id debe ser un entero'
+    if error is not None:
+        return jsonify({'msg': error}), 400
+
     character = Character.query.get(character_id)
 
     if not character:
         return jsonify({'msg': 'Personaje no encontrado'}), 404
 
+    if "planet_id" in body:
+        error = planet_error(body['planet_id'])
+        if error is not None:
+            return jsonify({'msg': error}), 404
+
     # Actualiza los campos si están presentes en el cuerpo de la solicitud
     if "name" in body:
         character.name = body['name']
+        search.index('character', character_id, character.name)
     if "height" in body:
         character.height = body['height']
     if "mass" in body:
@@ -261,57 +480,60 @@ def update_character(character_id):
         character.planet_id = body['planet_id']
 
     db.session.commit()
+    entity_cache.invalidate(('characters', character_id), ('characters', '*'))
 
     return jsonify({'msg': 'Personaje actualizado exitosamente', 'character': character.serialize()}), 200
 
 
-
-
-
-
-
-
-
-
-
-
 @app.route('/vehicles', methods=['GET'])
+@conditional('vehicles')
 def get_vehicles():
-    vehicles = Vehicle.query.all()
-    serialized_vehicles = [vehicle.serialize() for vehicle in vehicles]
-    return jsonify({'msg': "ok", 'result': serialized_vehicles}), 200
+    fields = SparseFields(Vehicle)
+    query = fields.query()
+    if wants_stream():
+        return stream_json(query, Vehicle, fields.row)
+
+    page = cached_page(query, Vehicle, fields.row, ('vehicles',))
+    return jsonify({'msg': "ok", 'result': page['result'], 'next': page['next']}), 200
 
 @app.route('/vehicles/<int:vehicle_id>', methods=['GET'])
+@conditional('vehicles')
 def get_vehicle(vehicle_id):
-    vehicle = Vehicle.query.get(vehicle_id)
-    
-    if vehicle:
-        serialized_vehicle = vehicle.serialize()
+    fields = SparseFields(Vehicle)
+    serialized_vehicle = entity_cache.fetch(
+        cache_key(('vehicles',), 'vehicles', vehicle_id, *fields.key()),
+        lambda: fields.get(vehicle_id),
+        depends_on=lambda vehicle: [('vehicles', vehicle_id)],
+    )
+
+    if serialized_vehicle:
         return jsonify({'msg': "ok", 'result': serialized_vehicle}), 200
     else:
         return jsonify({'msg': "Vehicle not found", 'result': {}}), 404
-    
 
 
 @app.route('/vehicles', methods=['POST'])
 def create_vehicle():
     data = request.get_json()
 
-    if not data or "name" not in data or "type" not in data:
-        return jsonify({'msg': 'Debes proporcionar el nombre del vehículo y el tipo'}), 400
+    if isinstance(data, list):
+        return create_many(Vehicle, data, vehicle_row, 'vehicles')
 
-    new_vehicle = Vehicle(
-        name=data['name'],
-        type=data['type']
-    )
+    row, error = vehicle_row(data)
+    if error is not None:
+        return jsonify({'msg': error}), 400
+
+    new_vehicle = Vehicle(**row)
 
     db.session.add(new_vehicle)
+    db.session.flush()
+    search.index('vehicle', new_vehicle.id, new_vehicle.name)
     db.session.commit()
+    entity_cache.invalidate(('vehicles', '*'))
 
     return jsonify({'msg': 'Vehículo creado exitosamente', 'vehicle': new_vehicle.serialize()}), 201
 
 
-
 @app.route('/vehicle/<int:vehicle_id>', methods=['PUT'])
 def update_vehicle(vehicle_id):
     body = request.get_json(silent=True)
@@ -319,6 +541,10 @@ def update_vehicle(vehicle_id):
     if body is None:
         return jsonify({'msg': 'Debes enviar información en el body'}), 400
 
+    error = update_error(body, Vehicle, texts=('name', 'type'))
+    if error is not None:
+        return jsonify({'msg': error}), 400
+
     vehicle = Vehicle.query.get(vehicle_id)
 
     if not vehicle:
@@ -327,15 +553,16 @@ def update_vehicle(vehicle_id):
     # Actualiza los campos si están presentes en el cuerpo de la solicitud
     if "name" in body:
         vehicle.name = body['name']
+        search.index('vehicle', vehicle_id, vehicle.name)
     if "type" in body:
         vehicle.type = body['type']
 
     db.session.commit()
+    entity_cache.invalidate(('vehicles', vehicle_id), ('vehicles', '*'))
 
     return jsonify({'msg': 'Vehículo actualizado exitosamente', 'vehicle': vehicle.serialize()}), 200
 
 
-
 @app.route('/vehicle/<int:vehicle_id>', methods=['DELETE'])
 def delete_vehicle(vehicle_id):
     vehicle = Vehicle.query.get(vehicle_id)
@@ -344,11 +571,79 @@ def delete_vehicle(vehicle_id):
         return jsonify({'msg': 'Vehículo no encontrado'}), 404
 
     db.session.delete(vehicle)
+    search.remove('vehicle', vehicle_id)
+    FavoriteCount.forget('vehicle', vehicle_id)
     db.session.commit()
+    entity_cache.invalidate(('vehicles', vehicle_id), ('vehicles', '*'))
 
     return jsonify({'msg': 'Vehículo eliminado exitosamente'}), 200
 
 
+def int_arg(name, default=None, minimum=1, maximum=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise APIException('El parámetro {} debe ser un entero'.format(name), status_code=400)
+    if value < minimum or (maximum is not None and value > maximum):
+        raise APIException('El parámetro {} debe estar entre {} y {}'.format(name, minimum, maximum or 'infinito'), status_code=400)
+    return value
+
+@app.route('/stats/planets', methods=['GET'])
+@conditional('planets')
+def get_planet_stats():
+    buckets = int_arg('buckets', maximum=100)
+    result = entity_cache.fetch(
+        cache_key(('planets',), 'stats', 'planets', buckets),
+        lambda: stats.planet_stats(buckets),
+        depends_on=lambda result: [('planets', '*')],
+    )
+    return jsonify({'msg': 'ok', 'result': result}), 200
+
+@app.route('/stats/characters', methods=['GET'])
+@conditional('characters', 'planets')
+def get_character_stats():
+    buckets = int_arg('buckets', maximum=100)
+    planet_id = int_arg('planet_id')
+    limit = int_arg('limit', 100, maximum=app.config['API_MAX_PAGE_SIZE'])
+    result = entity_cache.fetch(
+        cache_key(('characters', 'planets'), 'stats', 'characters', buckets, planet_id, limit),
+        lambda: stats.character_stats(buckets, planet_id, limit),
+        depends_on=lambda result: [('characters', '*'), ('planets', '*')],
+    )
+    return jsonify({'msg': 'ok', 'result': result}), 200
+
+@app.route('/search', methods=['GET'])
+def search_catalog():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'msg': 'Debes indicar el texto a buscar en el parámetro q'}), 400
+
+    types = request.args.get('type')
+    types = types.split(',') if types else list(search.ENTITIES)
+    unknown = [type for type in types if type not in search.ENTITIES]
+    if unknown:
+        return jsonify({'msg': 'Tipo no válido: {}. Usa {}'.format(', '.join(unknown), ', '.join(search.ENTITIES))}), 400
+
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'msg': 'El parámetro limit debe ser un entero'}), 400
+    if limit < 1:
+        return jsonify({'msg': 'El parámetro limit debe ser mayor que 0'}), 400
+
+    result = search.search(q, types, min(limit, app.config['API_MAX_PAGE_SIZE']))
+    return jsonify({'msg': 'ok', 'result': result}), 200
+
+@app.cli.command('search-rebuild')
+def search_rebuild():
+    """Rebuild the full-text search index from planets, characters and vehicles."""
+    print('{} nombres indexados'.format(search.rebuild()))
+
+
+app.cli.add_command(seed_command)
 
 @app.route('/favorites/user/<int:user_id>', methods=['GET'])
 def get_favorites(user_id):
@@ -356,11 +651,12 @@ def get_favorites(user_id):
     if user is None:
         return jsonify({'msg': f'El usuario con id {user_id} no existe'}), 404
 
-    favorites = Favorite.query.filter_by(user_id=user_id).all()
+    fields = SparseFields(Favorite)
+    favorites = fields.query().filter(Favorite.user_id == user_id).order_by(Favorite.id).all()
     favorites_serialize = []
 
     for favorite_item in favorites:
-        favorites_serialize.append({'favorite': favorite_item.serialize()})
+        favorites_serialize.append({'favorite': fields.row(favorite_item)})
 
     return jsonify({'msg': 'ok', 'result': favorites_serialize, 'user': user.serialize()}), 200
 
@@ -382,17 +678,31 @@ def add_favorite(user_id):
     if type not in ['planet', 'vehicle', 'character']:
         return jsonify({'msg': 'Tipo no válido'}), 400
 
+    if not is_int(item_id):
+        return jsonify({'msg': 'item_id debe ser un entero'}), 400
+
+    # checked up front like batch_favorites does, so the IntegrityError below can only be a duplicate
+    if db.session.query(FAVORITE_TYPES[type][1].id).filter_by(id=item_id).first() is None:
+        return jsonify({'msg': 'El {} {} no existe'.format(type, item_id)}), 404
+
     new_favorite = Favorite(user_id=user_id)
 
     if type == 'planet':
         new_favorite.planet_id = item_id
     elif type == 'vehicle':
-        new_favorite.vehicle_id = item_id
+        new_favorite.vehicles_id = item_id
     elif type == 'character':
-        new_favorite.character_id = item_id
+        new_favorite.characters_id = item_id
 
     db.session.add(new_favorite)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'msg': 'El favorito ya existe'}), 409
+    FavoriteCount.change({(type, item_id): 1})
     db.session.commit()
+    entity_cache.invalidate(('favorite', '*'))
 
     return jsonify({'msg': 'Favorito creado exitosamente'}), 201
 
@@ -400,7 +710,7 @@ def add_favorite(user_id):
 @app.route('/favorites/user/<int:user_id>/remove', methods=['DELETE'])
 def remove_favorite(user_id):
     user = User.query.get(user_id)
-    
+
     data = request.get_json()
 
     if not data or 'favorite_id' not in data:
@@ -412,36 +722,150 @@ def remove_favorite(user_id):
     if user is None or favorite is None or favorite.user_id != user_id:
         return jsonify({'msg': 'El usuario o el favorito no existen'}), 404
 
+    item = FavoriteCount.item(favorite)
     db.session.delete(favorite)
+    if item is not None:
+        FavoriteCount.change({item: -1})
     db.session.commit()
+    entity_cache.invalidate(('favorite', '*'))
 
     return jsonify({'msg': 'Favorito eliminado exitosamente'}), 200
 
-@app.route('/favorites/all', methods=['GET'])
-def get_all_favorites():
-    all_favorites = Favorite.query.all()
-
-    all_favorites_serialize = []
-
-    for favorite_item in all_favorites:
-        all_favorites_serialize.append({'favorite': favorite_item.serialize()})
-
-    return jsonify({'msg': 'ok', 'result': all_favorites_serialize}), 200
-
-
-
-
-
-
-
-
-
-
-
+@app.route('/favorites/user/<int:user_id>/batch', methods=['POST'])
+def batch_favorites(user_id):
+    user = User.query.get(user_id)
 
+    if user is None:
+        return jsonify({'msg': 'El usuario no existe'}), 404
 
+    data = request.get_json(silent=True)
+    to_add = data.get('add', []) if isinstance(data, dict) else None
+    to_remove = data.get('remove', []) if isinstance(data, dict) else None
+
+    if not isinstance(to_add, list) or not isinstance(to_remove, list):
+        return jsonify({'msg': 'Debes enviar las listas add y remove en el cuerpo de la solicitud'}), 400
+
+    errors = []
+    wanted = {}
+    for index, item in enumerate(to_add):
+        if not isinstance(item, dict) or item.get('type') not in FAVORITE_TYPES or not is_int(item.get('item_id')):
+            errors.append({'index': index, 'msg': 'Datos no válidos'})
+            continue
+        wanted.setdefault(item['type'], {}).setdefault(item['item_id'], index)
+
+    for type, items in wanted.items():
+        model = FAVORITE_TYPES[type][1]
+        found = {id for (id,) in query_in_chunks([model.id], model.id, items)}
+        errors.extend({'index': index, 'msg': 'El {} {} no existe'.format(type, item_id)} for item_id, index in items.items() if item_id not in found)
+
+    remove_ids = {favorite_id for favorite_id in to_remove if is_int(favorite_id)}
+    owned = {id for (id,) in query_in_chunks([Favorite.id], Favorite.id, remove_ids, Favorite.user_id == user_id)}
+    errors.extend({'favorite_id': favorite_id, 'msg': 'El favorito no existe'} for favorite_id in to_remove if favorite_id not in owned)
+
+    if errors:
+        return jsonify({'msg': 'El lote contiene errores, no se aplicó ningún cambio', 'errors': errors}), 400
+
+    # popularity counters move in the same transaction as the favorites
+    deltas = Counter()
+    removed = query_in_chunks([Favorite.planet_id, Favorite.vehicles_id, Favorite.characters_id], Favorite.id, remove_ids, Favorite.user_id == user_id)
+    for item in filter(None, map(FavoriteCount.item, removed)):
+        deltas[item] -= 1
+    remove_ids = list(remove_ids)
+    for start in range(0, len(remove_ids), 500):
+        Favorite.query.filter(Favorite.user_id == user_id, Favorite.id.in_(remove_ids[start:start + 500])).delete(synchronize_session=False)
+
+    # skip favorites the user already has so a sync can be replayed safely
+    current = set(db.session.query(Favorite.planet_id, Favorite.vehicles_id, Favorite.characters_id).filter_by(user_id=user_id))
+    rows = []
+    for type, items in wanted.items():
+        column = FAVORITE_TYPES[type][0]
+        for item_id in items:
+            row = {'user_id': user_id, 'planet_id': None, 'vehicles_id': None, 'characters_id': None, column: item_id}
+            if (row['planet_id'], row['vehicles_id'], row['characters_id']) not in current:
+                rows.append(row)
+                deltas[(type, item_id)] += 1
+    if rows:
+        db.session.execute(Favorite.__table__.insert(), rows)
+    FavoriteCount.change(deltas)
+
+    # built before the commit: if it failed, the client would get an error for a batch that was
+    # saved, and its retry would then collide with the favorites it already added
+    favorites = Favorite.query.options(*FAVORITE_LOAD).filter_by(user_id=user_id).order_by(Favorite.id).all()
+    result = [{'favorite': favorite_item.serialize()} for favorite_item in favorites]
+    db.session.commit()
+    entity_cache.invalidate(('favorite', '*'))
+
+    return jsonify({'msg': 'ok', 'result': result}), 200
+
+@app.route('/favorites/top', methods=['GET'])
+def get_top_favorites():
+    types = request.args.get('type')
+    types = types.split(',') if types else list(FAVORITE_TYPES)
+    unknown = [type for type in types if type not in FAVORITE_TYPES]
+    if unknown:
+        return jsonify({'msg': 'Tipo no válido: {}. Usa {}'.format(', '.join(unknown), ', '.join(FAVORITE_TYPES))}), 400
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'msg': 'El parámetro limit debe ser un entero'}), 400
+    if limit < 1:
+        return jsonify({'msg': 'El parámetro limit debe ser mayor que 0'}), 400
+    limit = min(limit, app.config['API_MAX_PAGE_SIZE'])
+
+    def load():
+        # top `limit` of every type from the counter index, then merged; never touches favorite
+        ranked = sorted(
+            ((count, type, item_id) for type, item_id, count in FavoriteCount.top(types, limit)),
+            key=lambda entry: entry[0], reverse=True,
+        )[:limit]
+        items = {}
+        for type in types:
+            model = FAVORITE_TYPES[type][1]
+            ids = [item_id for _, entry_type, item_id in ranked if entry_type == type]
+            if ids:
+                query = model.query.options(*(CHARACTER_LOAD if model is Character else ())).filter(model.id.in_(ids))
+                items.update(((type, item.id), item.serialize()) for item in query)
+        return [
+            {'type': type, 'count': count, 'item': items[(type, item_id)]}
+            for count, type, item_id in ranked if (type, item_id) in items
+        ]
+
+    tables = ('favorite',) + tuple(sorted({FAVORITE_TYPES[type][1].__tablename__ for type in types} | {'planets'}))
+    result = entity_cache.fetch(
+        cache_key(tables, 'favorite_top', tuple(types), limit), load,
+        depends_on=lambda result: [('favorite', '*'), ('planets', '*')] + [(FAVORITE_TYPES[type][1].__tablename__, '*') for type in types],
+    )
+    return jsonify({'msg': 'ok', 'result': result}), 200
+
+@app.cli.command('favorites-top-rebuild')
+def favorites_top_rebuild():
+    """Recount the favorites popularity counters from the favorite table."""
+    FavoriteCount.rebuild()
+    # the workers' cached /favorites/top entries are keyed by this version
+    TableVersion.bump('favorite')
+    db.session.commit()
+    entity_cache.invalidate(('favorite', '*'))
+    print('Contadores de favoritos recalculados')
 
+@app.route('/favorites/all', methods=['GET'])
+def get_all_favorites():
+    fields = SparseFields(Favorite)
+    query = fields.query()
+    if wants_stream():
+        return stream_json(query, Favorite, lambda favorite_item: {'favorite': fields.row(favorite_item)})
+
+    page = cached_page(
+        query, Favorite,
+        lambda favorite_item: {'favorite': fields.row(favorite_item)},
+        ('favorite', 'planets', 'characters', 'vehicles'),
+    )
+    return jsonify({'msg': 'ok', 'result': page['result'], 'next': page['next']}), 200
 
+@app.route('/export/<resource>', methods=['GET'])
+def export(resource):
+    if resource not in EXPORTS:
+        return jsonify({'msg': 'No se puede exportar {}. Usa {}'.format(resource, ', '.join(EXPORTS))}), 404
+    return stream_export(EXPORTS[resource], resource)
 
 
 # this only runs if `$ python src/app.py` is executed
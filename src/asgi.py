@@ -0,0 +1,200 @@
+# ASGI entry point for the read endpoints, served with async SQLAlchemy sessions so one process
+# keeps many database round trips in flight. Writes, the admin and everything else stay on wsgi.py.
+#
+#   $ pipenv install --dev    # uvicorn, asyncpg and aiosqlite
+#   $ uvicorn asgi:application --app-dir src/
+#
+# Responses follow the same JSON contract as the Flask handlers in app.py. Filters, ?sort= and
+# ?fields= are only served there; this server answers 400 to them.
+
+import os
+import re
+from urllib.parse import parse_qs
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import engine_options, use_sqlite_pragmas
+from json_provider import dumps
+from models import User, Planet, Character, Vehicle, Favorite, CHARACTER_LOAD, FAVORITE_LOAD
+
+# backend -> async dialect+driver; any sync driver in the URL (postgresql+psycopg2://, mysql+pymysql://...) is replaced
+ASYNC_DRIVERS = {
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+    'mariadb': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_url(url):
+    scheme, separator, rest = url.partition('://')
+    backend = scheme.partition('+')[0]
+    if not separator or backend not in ASYNC_DRIVERS:
+        return url
+    return ASYNC_DRIVERS[backend] + '://' + rest
+
+
+class HTTPError(Exception):
+    def __init__(self, status, body):
+        Exception.__init__(self)
+        self.status = status
+        self.body = body
+
+
+def page_args(args):
+    max_size = int(os.getenv("API_MAX_PAGE_SIZE", 1000))
+    try:
+        limit = int(args.get('limit', os.getenv("API_DEFAULT_PAGE_SIZE", 100)))
+        after = int(args['after']) if 'after' in args else None
+    except ValueError:
+        raise HTTPError(400, {'message': 'Los parámetros limit y after deben ser enteros'})
+    if limit < 1:
+        raise HTTPError(400, {'message': 'El parámetro limit debe ser mayor que 0'})
+    return min(limit, max_size), after
+
+
+# ?fields=... and ?fields[<relation>]=..., see utils.SparseFields
+FIELDS_PARAM = re.compile(r'^fields(?:\[\w+\])?$')
+
+
+def reject_unsupported(args, model=None):
+    """Answer 400 for the parameters the Flask app understands and this server doesn't, instead of ignoring them.
+
+    Only primary key pages of whole rows are served here; with a model, its filters, sort and
+    stream are rejected too.
+    """
+    names = set()
+    if model is not None:
+        names.update(('sort', 'stream'))
+        for name in getattr(model, 'filterable', ()):
+            names.update(name + suffix for suffix in ('', '_min', '_max', '_prefix'))
+    unsupported = sorted(key for key in args if key in names or FIELDS_PARAM.match(key))
+    if unsupported:
+        raise HTTPError(400, {'message': 'Parámetros no soportados por el servidor asíncrono: {}. Usa la API principal'.format(', '.join(unsupported))})
+
+
+async def paginate(session, statement, model, args):
+    """Keyset pagination over the primary key, same semantics as utils.paginate."""
+    limit, after = page_args(args)
+    if after is not None:
+        statement = statement.where(model.id > after)
+    rows = (await session.execute(statement.order_by(model.id).limit(limit + 1))).scalars().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return rows, next_cursor
+
+
+def list_endpoint(model, options=(), wrap=None):
+    async def handler(session, args):
+        reject_unsupported(args, model)
+        rows, next_cursor = await paginate(session, select(model).options(*options), model, args)
+        result = [wrap(row.serialize()) if wrap else row.serialize() for row in rows]
+        return 200, {'msg': 'ok', 'result': result, 'next': next_cursor}
+    return handler
+
+
+def detail_endpoint(model, not_found, options=()):
+    async def handler(session, args, id):
+        reject_unsupported(args)
+        instance = (await session.execute(select(model).options(*options).where(model.id == id))).scalars().first()
+        if instance is None:
+            return 404, {'msg': not_found, 'result': {}}
+        return 200, {'msg': 'ok', 'result': instance.serialize()}
+    return handler
+
+
+async def user_favorites(session, args, id):
+    reject_unsupported(args)
+    user = await session.get(User, id)
+    if user is None:
+        return 404, {'msg': f'El usuario con id {id} no existe'}
+    favorites = (await session.execute(select(Favorite).options(*FAVORITE_LOAD).where(Favorite.user_id == id).order_by(Favorite.id))).scalars().all()
+    return 200, {'msg': 'ok', 'result': [{'favorite': favorite.serialize()} for favorite in favorites], 'user': user.serialize()}
+
+
+ROUTES = [
+    (re.compile(r'^/planets/?$'), list_endpoint(Planet)),
+    (re.compile(r'^/planets/(?P<id>\d+)/?$'), detail_endpoint(Planet, 'Planet not found')),
+    (re.compile(r'^/characters/?$'), list_endpoint(Character, CHARACTER_LOAD)),
+    (re.compile(r'^/characters/(?P<id>\d+)/?$'), detail_endpoint(Character, 'Character not found', CHARACTER_LOAD)),
+    (re.compile(r'^/vehicles/?$'), list_endpoint(Vehicle)),
+    (re.compile(r'^/vehicles/(?P<id>\d+)/?$'), detail_endpoint(Vehicle, 'Vehicle not found')),
+    (re.compile(r'^/favorites/all/?$'), list_endpoint(Favorite, FAVORITE_LOAD, wrap=lambda favorite: {'favorite': favorite})),
+    (re.compile(r'^/favorites/user/(?P<id>\d+)/?$'), user_favorites),
+]
+
+
+class ReadAPI:
+    def __init__(self, database_url, **engine_options):
+        self.database_url = async_url(database_url)
+        self.engine_options = engine_options
+        self.engine = None
+        self.session_factory = None
+
+    def start(self):
+        # created on first use so every forked worker gets its own engine
+        self.engine = create_async_engine(self.database_url, **self.engine_options)
+        # the same WAL, busy_timeout and cache PRAGMAs as the Flask app's engine
+        use_sqlite_pragmas(self.engine.sync_engine)
+        self.session_factory = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        status, body = await self.dispatch(scope)
+        # same encoding as Flask's jsonify with the provider from json_provider.init_json
+        payload = (dumps(body) + '\n').encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def dispatch(self, scope):
+        if scope['method'] != 'GET':
+            return 405, {'message': 'Este servidor solo atiende lecturas'}
+        for pattern, handler in ROUTES:
+            match = pattern.match(scope['path'])
+            if match is None:
+                continue
+            args = {key: values[-1] for key, values in parse_qs(scope['query_string'].decode('utf-8', 'replace')).items()}
+            params = {key: int(value) for key, value in match.groupdict().items()}
+            if self.engine is None:
+                self.start()
+            try:
+                async with self.session_factory() as session:
+                    return await handler(session, args, **params)
+            except HTTPError as error:
+                return error.status, error.body
+        return 404, {'message': 'Ruta no encontrada'}
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def async_engine_options(url):
+    options = engine_options(url)
+    # async engines need their own adapted queue pool
+    options.pop('poolclass', None)
+    return options
+
+
+db_url = os.getenv("DATABASE_URL", "sqlite:////tmp/test.db")
+application = ReadAPI(db_url, **async_engine_options(db_url))
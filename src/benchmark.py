@@ -0,0 +1,443 @@
+"""
+Reproducible endpoint benchmarks against a seeded SQLite database.
+
+    $ pipenv run benchmark --rows 1000 --rows 100000 --out bench.json
+    $ pipenv run benchmark --rows 1000 --compare bench.json
+    $ WEB_WORKER_CLASS=gthread pipenv run benchmark --transport gunicorn --concurrency 16
+
+Every scale runs in its own process, because the app binds its engine to DATABASE_URL at import time.
+Write endpoints are timed like the reads; after each of them the seeded rows are put back, so every
+round runs on the same data.
+"""
+import argparse
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def seed(db, models, rows, batch_size=10000):
+    """Insert `rows` planets, characters, vehicles and favorites (and rows // 100 users) with executemany batches."""
+    users = max(rows // 100, 1)
+
+    def insert(model, make, count):
+        for start in range(0, count, batch_size):
+            db.session.execute(model.__table__.insert(), [make(i) for i in range(start, min(start + batch_size, count))])
+        db.session.commit()
+
+    rng = random.Random(rows)
+    insert(models.User, lambda i: {'id': i + 1, 'email': 'user{}@example.com'.format(i), 'password': 'x', 'is_active': True}, users)
+    insert(models.Planet, lambda i: {'id': i + 1, 'name': 'Planet {}'.format(i), 'population': rng.randint(0, 10 ** 9)}, rows)
+    insert(models.Character, lambda i: {
+        'id': i + 1, 'name': 'Character {}'.format(i), 'height': rng.randint(50, 250),
+        'mass': rng.randint(20, 200), 'planet_id': rng.randint(1, rows),
+    }, rows)
+    insert(models.Vehicle, lambda i: {'id': i + 1, 'name': 'Vehicle {}'.format(i), 'type': rng.choice(['speeder', 'starfighter', 'walker'])}, rows)
+
+    # (type, user, item) triples are unique, so the favorite unique indexes hold
+    columns = ('planet_id', 'vehicles_id', 'characters_id')
+
+    def favorite(i):
+        k = i // 3
+        row = {'id': i + 1, 'user_id': k % users + 1, 'planet_id': None, 'vehicles_id': None, 'characters_id': None}
+        row[columns[i % 3]] = k // users + 1
+        return row
+    insert(models.Favorite, favorite, rows)
+    models.FavoriteCount.rebuild()
+    db.session.commit()
+
+    import search
+    search.rebuild(batch_size)
+
+
+def snapshot(path):
+    """Copy of the freshly seeded database, taken with the backup API so the WAL is included."""
+    target = path + '.seed'
+    source, copy = sqlite3.connect(path), sqlite3.connect(target)
+    try:
+        source.backup(copy)
+    finally:
+        source.close()
+        copy.close()
+    return target
+
+
+def reset(path, seed_path):
+    """Put the seeded rows back after a round of writes.
+
+    table_version is left alone and every version moves forward, so no cache (in this process or in
+    the gunicorn workers) keeps serving rows from before the reset under a version it already saw.
+    """
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    try:
+        conn.execute('ATTACH DATABASE ? AS seed', (seed_path,))
+        tables = [name for (name,) in conn.execute(
+            "SELECT name FROM seed.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+            "AND name NOT LIKE 'search_index_%' AND name NOT IN ('table_version', 'alembic_version')"
+        )]
+        conn.execute('BEGIN IMMEDIATE')
+        for table in tables:
+            conn.execute('DELETE FROM main.{0}'.format(table))
+            if table == 'search_index':
+                # FTS5 keeps its rowid outside the declared columns
+                conn.execute('INSERT INTO main.search_index (rowid, name, entity, entity_id) '
+                             'SELECT rowid, name, entity, entity_id FROM seed.search_index')
+            else:
+                conn.execute('INSERT INTO main.{0} SELECT * FROM seed.{0}'.format(table))
+        conn.execute('UPDATE main.table_version SET version = version + 1')
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE seed')
+    finally:
+        conn.close()
+
+
+def endpoints(rows, rng):
+    """(name, request) pairs; request() returns the next (method, path, JSON body) to send."""
+    users = max(rows // 100, 1)
+
+    def get(path_for):
+        return lambda: ('GET', path_for(), None)
+
+    # names are unique, and every DELETE of a round needs a planet that is still there
+    serial = itertools.count(1)
+    planets_to_delete = itertools.cycle(rng.sample(range(1, rows + 1), rows))
+    # and concurrent batches never race to add the same favorite
+    items = [(type, id) for type in ('planet', 'character', 'vehicle') for id in range(1, rows + 1)]
+    favorites_to_add = itertools.cycle(rng.sample(items, len(items)))
+    return [
+        ('GET /planets', get(lambda: '/planets')),
+        ('GET /planets?limit=1000', get(lambda: '/planets?limit=1000')),
+        ('GET /planets/<id>', get(lambda: '/planets/{}'.format(rng.randint(1, rows)))),
+        ('GET /characters', get(lambda: '/characters')),
+        ('GET /characters/<id>', get(lambda: '/characters/{}'.format(rng.randint(1, rows)))),
+        ('GET /vehicles', get(lambda: '/vehicles')),
+        ('GET /vehicles/<id>', get(lambda: '/vehicles/{}'.format(rng.randint(1, rows)))),
+        ('GET /user', get(lambda: '/user')),
+        ('GET /user/<id>', get(lambda: '/user/{}'.format(rng.randint(1, users)))),
+        ('GET /favorites/all', get(lambda: '/favorites/all')),
+        ('GET /favorites/user/<id>', get(lambda: '/favorites/user/{}'.format(rng.randint(1, users)))),
+        ('GET /favorites/top', get(lambda: '/favorites/top')),
+        ('GET /planets?after=<deep>', get(lambda: '/planets?after={}'.format(rows - 150))),
+        ('GET /search?q=<prefix>', get(lambda: '/search?q={}'.format(rng.randint(1, rows) // 10))),
+        ('GET /stats/planets', get(lambda: '/stats/planets')),
+        ('GET /stats/characters', get(lambda: '/stats/characters?buckets=20')),
+        ('GET /export/planets', get(lambda: '/export/planets')),
+        ('GET /export/favorites?format=csv', get(lambda: '/export/favorites?format=csv')),
+        ('POST /planets', lambda: ('POST', '/planets', {'name': 'New planet {}'.format(next(serial)), 'population': rng.randint(0, 10 ** 9)})),
+        ('POST /characters', lambda: ('POST', '/characters', {
+            'name': 'New character {}'.format(next(serial)), 'height': rng.randint(50, 250), 'mass': rng.randint(20, 200), 'planet_id': rng.randint(1, rows),
+        })),
+        ('PUT /planet/<id>', lambda: ('PUT', '/planet/{}'.format(rng.randint(1, rows)), {
+            'name': 'Renamed planet {}'.format(next(serial)), 'population': rng.randint(0, 10 ** 9),
+        })),
+        ('DELETE /planet/<id>', lambda: ('DELETE', '/planet/{}'.format(next(planets_to_delete)), None)),
+        ('POST /favorites/user/<id>/batch', lambda: ('POST', '/favorites/user/{}/batch'.format(rng.randint(1, users)), {
+            'add': [{'type': type, 'item_id': id} for type, id in itertools.islice(favorites_to_add, 10)],
+            'remove': [],
+        })),
+    ]
+
+
+class TestClientTransport:
+    name = kind = 'test_client'
+    in_all = True
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, len(response.get_data())
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    """Keep-alive HTTP/1.1 client, one connection per benchmark thread."""
+
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+        self.connections = []
+
+    def request(self, method, path, body=None):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection('127.0.0.1', self.port)
+            self.connections.append(conn)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # the server dropped an idle keep-alive connection (keepalive timeout, recycled worker)
+            # before reading the request; like any HTTP client, retry once on a new one
+            conn.close()
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+        return response.status, len(response.read())
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+
+
+class WSGIServerTransport(HTTPTransport):
+    name = kind = 'wsgi_server'
+    in_all = True
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        super().__init__(self.server.server_port)
+
+    def close(self):
+        super().close()
+        self.server.shutdown()
+
+
+class GunicornTransport(HTTPTransport):
+    """gunicorn with gunicorn.conf.py in a subprocess; WEB_WORKER_CLASS and friends come from the environment.
+
+    SQL statements run in the workers, so queries_per_request and peak_alloc_kb don't apply.
+    """
+    kind = 'gunicorn'
+    # a subprocess with its own workers; only when asked for by name
+    in_all = False
+
+    def __init__(self, app):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', HERE, '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+             '--bind', '127.0.0.1:{}'.format(port), '--log-level', 'warning'],
+            # stdout carries this process's JSON report back to the parent
+            cwd=ROOT, stdout=sys.stderr,
+        )
+        self.name = 'gunicorn_' + os.getenv('WEB_WORKER_CLASS', 'gthread')
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.1)
+        super().__init__(port)
+
+    def close(self):
+        super().close()
+        self.process.terminate()
+        self.process.wait()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run_endpoint(transport, request_for, requests, warmup, counter, concurrency=1):
+    for _ in range(warmup):
+        transport.request(*request_for())
+
+    # one untimed request under tracemalloc for the peak allocation of a single request
+    tracemalloc.start()
+    transport.request(*request_for())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    def timed(request):
+        t0 = time.perf_counter()
+        status, size = transport.request(*request)
+        return time.perf_counter() - t0, status, size
+
+    queued = [request_for() for _ in range(requests)]
+    latencies, statuses, total_bytes = [], {}, 0
+    counter[0] = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for latency, status, size in pool.map(timed, queued):
+            latencies.append(latency)
+            statuses[status] = statuses.get(status, 0) + 1
+            total_bytes += size
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'throughput_rps': round(requests / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'queries_per_request': round(counter[0] / requests, 2),
+        'bytes_per_response': total_bytes // requests,
+        'peak_alloc_kb': round(peak / 1024, 1),
+    }
+
+
+def run_scale(args):
+    """Child process: seed (or reuse) the database for one scale and benchmark every endpoint."""
+    path = os.path.join(args.data_dir, 'bench-{}.db'.format(args.rows))
+    seed_path = path + '.seed'
+    if args.reseed:
+        for name in (path, seed_path):
+            if os.path.exists(name):
+                os.remove(name)
+    fresh = not os.path.exists(path)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ.setdefault('CACHE_BACKEND', 'memory')
+    if not args.cache:
+        # measure the database path, not repeated cache hits on the same URL
+        os.environ['ENTITY_CACHE_SIZE'] = '0'
+    sys.path.insert(0, HERE)
+
+    import models
+    from app import app, db
+    from sqlalchemy import event
+
+    with app.app_context():
+        if fresh:
+            db.create_all()
+            t0 = time.perf_counter()
+            seed(db, models, args.rows)
+            print('seeded {} rows per table in {:.1f}s'.format(args.rows, time.perf_counter() - t0), file=sys.stderr)
+        if not os.path.exists(seed_path):
+            # what reset() puts back after every round of writes
+            snapshot(path)
+        counter = [0]
+        event.listen(db.engine, 'before_cursor_execute', lambda *a: counter.__setitem__(0, counter[0] + 1))
+
+    results = []
+    for transport_class in (TestClientTransport, WSGIServerTransport, GunicornTransport):
+        selected = args.transport == transport_class.kind or (args.transport == 'all' and transport_class.in_all)
+        if not selected:
+            continue
+        transport = transport_class(app)
+        rng = random.Random(args.rows)
+        try:
+            for name, request_for in endpoints(args.rows, rng):
+                result = run_endpoint(transport, request_for, args.requests, args.warmup, counter, args.concurrency)
+                if not name.startswith('GET '):
+                    reset(path, seed_path)
+                result.update({'endpoint': name, 'transport': transport.name, 'rows': args.rows})
+                results.append(result)
+                print('{:>8} {:<12} {:<32} {:>9.1f} req/s  p50 {:>8.2f}ms  p99 {:>8.2f}ms  {:>5} q/req'.format(
+                    args.rows, transport.name, name, result['throughput_rps'], result['p50_ms'], result['p99_ms'],
+                    result['queries_per_request']), file=sys.stderr)
+        finally:
+            # a gunicorn left running would outlive this process
+            transport.close()
+
+    import resource
+    json.dump({'rows': args.rows, 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'results': results}, sys.stdout)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Print throughput / p95 deltas against a previous run; returns the number of regressions above threshold."""
+    previous = {(r['rows'], r['transport'], r['endpoint']): r for r in baseline['results']}
+    regressions = 0
+    for result in current['results']:
+        old = previous.get((result['rows'], result['transport'], result['endpoint']))
+        if old is None:
+            continue
+        throughput = result['throughput_rps'] / old['throughput_rps'] - 1
+        p95 = result['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0
+        regressed = throughput < -threshold or p95 > threshold
+        regressions += regressed
+        print('{:>8} {:<12} {:<32} throughput {:+7.1%}  p95 {:+7.1%}{}'.format(
+            result['rows'], result['transport'], result['endpoint'], throughput, p95, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, action='append', help='rows per table, repeat for several scales (default 1000)')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--transport', choices=['all', 'test_client', 'wsgi_server', 'gunicorn'], default='all',
+                        help='all runs the in-process transports; gunicorn is opt-in')
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight at once')
+    parser.add_argument('--cache', action='store_true', help='keep the entity/page cache enabled')
+    parser.add_argument('--data-dir', default='/tmp', help='where the seeded bench-<rows>.db files are kept between runs')
+    parser.add_argument('--reseed', action='store_true', help='drop and re-seed the databases')
+    parser.add_argument('--out', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change counted as a regression')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.rows = args.rows[0]
+        return run_scale(args)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'cache': args.cache,
+        },
+        'scales': [],
+        'results': [],
+    }
+    for rows in args.rows or [1000]:
+        command = [sys.executable, os.path.abspath(__file__), '--child', '--rows', str(rows),
+                   '--requests', str(args.requests), '--warmup', str(args.warmup),
+                   '--transport', args.transport, '--concurrency', str(args.concurrency), '--data-dir', args.data_dir]
+        if args.reseed:
+            command.append('--reseed')
+        if args.cache:
+            command.append('--cache')
+        scale = json.loads(subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout)
+        report['scales'].append({'rows': rows, 'max_rss_kb': scale['max_rss_kb']})
+        report['results'].extend(scale['results'])
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(report, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
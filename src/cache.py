@@ -0,0 +1,353 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Per-process read-through cache of serialized entities, bounded in size with LRU eviction and optional TTL.
+
+    Entries can declare the keys they depend on (a character embeds its planet), so invalidating
+    a key also drops everything that depends on it. With maxbytes, values must be bytes and the
+    cache also evicts until their total length fits.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, maxbytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._dependents = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl and entry[1] < time.monotonic():
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, depends_on=()):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._discard(key)
+            self._data[key] = (value, expires, tuple(depends_on))
+            if self.maxbytes is not None:
+                self._bytes += len(value)
+            for dependency in depends_on:
+                self._dependents.setdefault(dependency, set()).add(key)
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self._bytes > self.maxbytes):
+                self._discard(next(iter(self._data)))
+                self.evictions += 1
+
+    def fetch(self, key, loader, depends_on=None):
+        """Return the cached value for key, or call loader() and cache its result unless it is None."""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value, depends_on(value) if depends_on else ())
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._discard(key)
+                for dependent in self._dependents.pop(key, ()):
+                    self._discard(dependent)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._dependents.clear()
+            self._bytes = 0
+
+    def stats(self):
+        stats = {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+        if self.maxbytes is not None:
+            stats.update(bytes=self._bytes, maxbytes=self.maxbytes)
+        return stats
+
+    def _discard(self, key):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        if self.maxbytes is not None:
+            self._bytes -= len(entry[0])
+        for dependency in entry[2]:
+            keys = self._dependents.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[dependency]
+
+
+class CacheBackend:
+    """Storage for SharedCache. Keys and values are strings."""
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError()
+
+    def delete(self, *keys):
+        raise NotImplementedError()
+
+
+class RedisBackend(CacheBackend):
+    """Minimal RESP client, enough for GET/SET/DEL against Redis or any server speaking its protocol."""
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=1.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        # one connection per thread, opened lazily so it is created after gunicorn forks
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url):
+        parsed = urlparse(url)
+        return cls(
+            host=parsed.hostname or 'localhost',
+            port=parsed.port or 6379,
+            db=int(parsed.path.lstrip('/') or 0),
+            password=parsed.password,
+        )
+
+    def get(self, key):
+        value = self._command('GET', key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self._command('SET', key, value, 'PX', int(ttl * 1000))
+        else:
+            self._command('SET', key, value)
+
+    def delete(self, *keys):
+        if keys:
+            self._command('DEL', *keys)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            if self.password:
+                self._command('AUTH', self.password)
+            if self.db:
+                self._command('SELECT', self.db)
+        return conn
+
+    def _command(self, *args):
+        sock, reader = self._connection()
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        try:
+            sock.sendall(b''.join(parts))
+            return self._read_reply(reader)
+        except OSError:
+            self._local.conn = None
+            sock.close()
+            raise
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the cache server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            raise ConnectionError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            return reader.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply(reader) for _ in range(length)]
+        raise ConnectionError('Unexpected reply from the cache server: %r' % line)
+
+
+class FileBackend(CacheBackend):
+    """Shared cache in a local directory, visible to every worker on the host. Meant for tests and single-box deploys.
+
+    Expired entries are deleted when they are read, and every `sweep_every` sets this process also
+    deletes the expired entries nobody asked for again.
+    """
+
+    def __init__(self, directory, sweep_every=1000):
+        self.directory = directory
+        self.sweep_every = sweep_every
+        os.makedirs(directory, exist_ok=True)
+        self._sets = 0
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['expires'] is not None and entry['expires'] < time.time():
+            self._remove(path)
+            return None
+        return entry['value']
+
+    def set(self, key, value, ttl=None):
+        path = self._path(key)
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            json.dump({'expires': time.time() + ttl if ttl else None, 'value': value}, f)
+        os.replace(tmp_path, path)
+        self._sets += 1
+        if self._sets % self.sweep_every == 0:
+            self.sweep()
+
+    def sweep(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.startswith('value-') or name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    expires = json.load(f)['expires']
+            except (OSError, ValueError):
+                continue
+            if expires is not None and expires < now:
+                self._remove(path)
+
+    def delete(self, *keys):
+        for key in keys:
+            self._remove(self._path(key))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, 'value-{}'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+
+class SharedCache:
+    """Same interface as LRUCache, backed by a CacheBackend shared by every worker.
+
+    Keys carry the versions of the tables an entry was read from (utils.cache_key), so a write in
+    any worker makes the old entries unreachable and there is nothing to invalidate or track: the
+    dependencies LRUCache keeps are ignored here. Every entry expires after `ttl` seconds instead,
+    since entries that are never read again would otherwise stay in the backend for good.
+    Backend errors are logged and treated as misses so the API keeps answering from the database.
+    """
+
+    def __init__(self, backend, ttl, prefix='swapi'):
+        if not ttl:
+            raise ValueError('SharedCache needs a ttl')
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key):
+        try:
+            value = self.backend.get(self._key(key))
+        except OSError:
+            logger.warning('Shared cache unavailable on get', exc_info=True)
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value, depends_on=()):
+        try:
+            self.backend.set(self._key(key), json.dumps(value), self.ttl)
+        except OSError:
+            logger.warning('Shared cache unavailable on set', exc_info=True)
+            self.errors += 1
+
+    def fetch(self, key, loader, depends_on=None):
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value, depends_on(value) if depends_on else ())
+        return value
+
+    def invalidate(self, *keys):
+        # the writes that call this have moved the table versions in the keys already
+        pass
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+    def _key(self, key):
+        return ':'.join([self.prefix, 'entry'] + [str(part) for part in key])
+
+
+def make_cache():
+    backend = os.getenv("CACHE_BACKEND", "memory")
+    if backend == "redis":
+        return SharedCache(RedisBackend.from_url(os.getenv("CACHE_URL", "redis://localhost:6379/0")), ttl=shared_ttl())
+    if backend == "file":
+        return SharedCache(FileBackend(os.getenv("CACHE_DIR", "/tmp/swapi-cache")), ttl=shared_ttl())
+    return LRUCache(maxsize=int(os.getenv("ENTITY_CACHE_SIZE", 1024)), ttl=float(os.getenv("ENTITY_CACHE_TTL", 0)) or None)
+
+
+def shared_ttl():
+    # the shared tier always expires its entries, 5 minutes unless ENTITY_CACHE_TTL says otherwise
+    ttl = float(os.getenv("ENTITY_CACHE_TTL", 300))
+    if ttl <= 0:
+        raise ValueError('ENTITY_CACHE_TTL debe ser mayor que 0 con CACHE_BACKEND={}'.format(os.getenv("CACHE_BACKEND")))
+    return ttl
+
+
+entity_cache = make_cache()
@@ -0,0 +1,126 @@
+import gzip
+import os
+import zlib
+
+from flask import request
+
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip is offered
+    brotli = None
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/csv', 'text/html', 'text/plain')
+
+
+def available_encodings():
+    # preference order when the client accepts several with the same quality
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def matching_etag(etag):
+    """The tag in If-None-Match that names `etag` in any encoding, or None.
+
+    Compressed responses carry etag-<encoding> (a different representation needs a different
+    strong ETag), so a client revalidates with whichever variant it last received.
+    """
+    for tag in [etag] + ['{}-{}'.format(etag, encoding) for encoding in available_encodings()]:
+        if request.if_none_match.contains(tag):
+            return tag
+    return None
+
+
+class Compression:
+    """gzip/brotli response compression negotiated from Accept-Encoding.
+
+    Bodies smaller than min_size or of other mimetypes are sent as they are. Responses with a strong
+    ETag (utils.conditional, from the table versions) are compressed once per URL and version: the
+    compressed body is kept in an LRU bounded to cache_bytes, keyed by encoding, ETag and URL. Other
+    responses are compressed every time. Streamed bodies are compressed chunk by chunk as they are sent.
+    """
+
+    def __init__(self, min_size=500, level=6, br_level=4, cache_bytes=16 * 2 ** 20):
+        self.min_size = min_size
+        self.level = level
+        self.br_level = br_level
+        self.cache = LRUCache(maxsize=4096, maxbytes=cache_bytes)
+
+    def init_app(self, app):
+        app.after_request(self._after_request)
+
+    def negotiate(self):
+        accepted = request.accept_encodings
+        best, quality = None, 0
+        for encoding in available_encodings():
+            if accepted[encoding] > quality:
+                best, quality = encoding, accepted[encoding]
+        return best
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.br_level)
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def compress_cached(self, data, encoding, etag):
+        # the same URL under the same table versions always has the same body
+        key = (encoding, etag, request.full_path)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = self.compress(data, encoding)
+            # one huge page would push out everything else
+            if len(compressed) <= self.cache.maxbytes // 8:
+                self.cache.set(key, compressed)
+        return compressed
+
+    def compress_stream(self, chunks, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.br_level)
+            compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+        for chunk in chunks:
+            data = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            # flush every chunk so slow streams still reach the client as they are produced
+            data += flush()
+            if data:
+                yield data
+        yield finish()
+
+    def _after_request(self, response):
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200 or 'Content-Encoding' in response.headers:
+            return response
+        if response.mimetype not in COMPRESSIBLE:
+            return response
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        if response.is_streamed:
+            response.response = self.compress_stream(response.response, encoding)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            if etag and not weak:
+                response.set_data(self.compress_cached(data, encoding, etag))
+            else:
+                response.set_data(self.compress(data, encoding))
+
+        response.headers['Content-Encoding'] = encoding
+        if etag and not weak:
+            response.set_etag('{}-{}'.format(etag, encoding))
+        return response
+
+
+compression = Compression(
+    min_size=int(os.getenv("COMPRESS_MIN_SIZE", 500)),
+    level=int(os.getenv("COMPRESS_LEVEL", 6)),
+    br_level=int(os.getenv("COMPRESS_BR_LEVEL", 4)),
+    cache_bytes=int(float(os.getenv("COMPRESS_CACHE_MB", 16)) * 2 ** 20),
+)
@@ -0,0 +1,134 @@
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+def env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that also measures how long requests wait for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS from the environment; SQLite is tuned with PRAGMAs on connect instead."""
+    if url.startswith('sqlite'):
+        return {}
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': env_bool('DB_POOL_PRE_PING', True),
+    }
+
+
+def sqlite_pragmas():
+    pragmas = {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': os.getenv('SQLITE_BUSY_TIMEOUT', '5000'),
+        'cache_size': os.getenv('SQLITE_CACHE_SIZE', '-20000'),
+    }
+    for name, value in pragmas.items():
+        # values end up in the PRAGMA statement, which takes no bound parameters
+        if not re.fullmatch(r'-?\w+', value):
+            raise ValueError('Valor no válido para PRAGMA {}: {!r}'.format(name, value))
+    return pragmas
+
+
+class PoolStats:
+    def __init__(self):
+        self.checked_out = 0
+        self.checkouts = 0
+        self.connects = 0
+        self._lock = threading.Lock()
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checked_out -= 1
+
+
+pool_stats = PoolStats()
+
+
+def use_sqlite_pragmas(engine):
+    """Run sqlite_pragmas() on every new connection of a SQLite engine (for an async one, its sync_engine)."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+        cursor.close()
+
+
+def init_engine(app, db):
+    """Connect-time PRAGMAs for SQLite and checkout/checkin accounting for every pool."""
+    with app.app_context():
+        engine = db.engine
+
+    use_sqlite_pragmas(engine)
+    event.listen(engine, 'connect', pool_stats.on_connect)
+    event.listen(engine, 'checkout', pool_stats.on_checkout)
+    event.listen(engine, 'checkin', pool_stats.on_checkin)
+
+
+def get_pool_stats(engine):
+    pool = engine.pool
+    stats = {
+        'pool': type(pool).__name__,
+        'checked_out': pool_stats.checked_out,
+        'checkouts': pool_stats.checkouts,
+        'connects': pool_stats.connects,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'timeout': pool.timeout(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'waits': pool.waits,
+            'wait_seconds_total': round(pool.wait_seconds, 6),
+            'wait_seconds_max': round(pool.max_wait_seconds, 6),
+        })
+    return stats
@@ -0,0 +1,50 @@
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: without it the standard library encoder is used
+    orjson = None
+
+
+def dumps(obj, default=None, sort_keys=True, indent=None, **kwargs):
+    """JSON text for obj with orjson when it is installed, otherwise with json.dumps.
+
+    Output differs only in whitespace and in non-ASCII text, which orjson writes as UTF-8
+    instead of \\u escapes; both decode to the same value.
+    """
+    if orjson is None:
+        kwargs.setdefault('separators', (',', ':'))
+        return json.dumps(obj, default=default, sort_keys=sort_keys, indent=indent, **kwargs)
+    # dates, datetimes and dataclasses still go through `default`, as with the standard encoder
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, for jsonify(), request.get_json() and streamed bodies."""
+
+    def dumps(self, obj, **kwargs):
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        kwargs.pop('ensure_ascii', None)
+        kwargs.pop('separators', None)
+        return dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def init_json(app):
+    """JSON_PROVIDER=orjson|json; the default picks orjson when it is installed."""
+    choice = os.getenv('JSON_PROVIDER', 'orjson' if orjson is not None else 'json')
+    if choice == 'orjson':
+        if orjson is None:
+            raise RuntimeError('JSON_PROVIDER=orjson requiere instalar orjson (pip install orjson)')
+        app.json = ORJSONProvider(app)
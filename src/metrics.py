@@ -0,0 +1,262 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status.', None),
+    'http_request_duration_seconds': ('histogram', 'Time spent handling a request.', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('histogram', 'Size of the response body (streamed bodies are not counted).', SIZE_BUCKETS),
+    'sql_statements_total': ('counter', 'SQL statements executed, by the endpoint that issued them.', None),
+    'sql_statement_duration_seconds': ('histogram', 'Time spent executing a single SQL statement.', LATENCY_BUCKETS),
+}
+
+
+class Metrics:
+    """Counters and histograms for the Prometheus text format.
+
+    Each gunicorn worker keeps its own values in memory. When METRICS_DIR is set, a background
+    thread in every worker writes a snapshot file there each `flush_interval` seconds and /metrics
+    sums the snapshots of all workers. The snapshots of workers that have exited are folded into one
+    aggregate file, so counters never go backwards and the directory doesn't grow with every restart.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._values = {}
+        self._changes = 0
+        self._flushed_changes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+        self._path = None
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', self._handle_error)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            self._changes += 1
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one slot per bucket plus +Inf, then sum
+                counts = self._values[key] = [0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-1] += value
+            self._changes += 1
+
+    def flush(self):
+        if not self.directory or self._changes == self._flushed_changes:
+            return
+        # gunicorn.conf.py removes the METRICS_DIR it made when the master exits, before atexit runs
+        if not os.path.isdir(self.directory):
+            return
+        with self._flush_lock:
+            if self._path is None or not self._path.startswith(self._prefix()):
+                self._path = os.path.join(self.directory, '{}{}.json'.format(self._prefix(), int(time.time() * 1000)))
+            with self._lock:
+                snapshot = [[name, labels, value] for (name, labels), value in self._values.items()]
+                changes = self._changes
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self._path)
+            self._flushed_changes = changes
+
+    def start_flusher(self):
+        """Start the thread that writes this worker's snapshot, once per process (gunicorn forks after import)."""
+        if not self.directory or self._flusher_pid == os.getpid():
+            return
+        with self._flush_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, name='metrics-flusher', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                logger.warning('Could not write the metrics snapshot', exc_info=True)
+
+    def collect(self):
+        """Values of this process plus, with METRICS_DIR, the last snapshot of every other worker."""
+        with self._lock:
+            totals = {key: (list(value) if isinstance(value, list) else value) for key, value in self._values.items()}
+        if self.directory:
+            self._fold_exited()
+            aggregate = _read_json(self._aggregate_path()) or {'folded': [], 'values': []}
+            add_snapshot(totals, aggregate['values'])
+            folded = set(aggregate['folded'])
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                # a folded file is only deleted after the aggregate that includes it has been written
+                if path == self._path or os.path.basename(path) in folded:
+                    continue
+                snapshot = _read_json(path)
+                if snapshot is not None:
+                    add_snapshot(totals, snapshot)
+        return totals
+
+    def _fold_exited(self):
+        paths = [path for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')) if not _is_running(_snapshot_pid(path))]
+        if not paths:
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            # one process folds at a time; the others wait and find the files already gone
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            aggregate = _read_json(self._aggregate_path()) or {'folded': [], 'values': []}
+            # names of files already deleted can't be counted twice any more
+            folded = [name for name in aggregate['folded'] if os.path.exists(os.path.join(self.directory, name))]
+            totals = {}
+            add_snapshot(totals, aggregate['values'])
+            for path in paths:
+                name = os.path.basename(path)
+                snapshot = None if name in folded else _read_json(path)
+                if snapshot is not None:
+                    add_snapshot(totals, snapshot)
+                    folded.append(name)
+            aggregate = {'folded': folded, 'values': [[name, labels, value] for (name, labels), value in totals.items()]}
+            tmp_path = self._aggregate_path() + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(aggregate, f)
+            os.replace(tmp_path, self._aggregate_path())
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _aggregate_path(self):
+        return os.path.join(self.directory, 'aggregate.json')
+
+    def _prefix(self):
+        return 'metrics-{}-'.format(os.getpid())
+
+    def render(self):
+        totals = self.collect()
+        lines = []
+        for name, (kind, description, buckets) in METRICS.items():
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for (metric, labels), value in sorted(totals.items()):
+                if metric != name:
+                    continue
+                if kind == 'counter':
+                    lines.append('{}{} {}'.format(name, format_labels(labels), value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', str(bound)),)), cumulative))
+                lines.append('{}_sum{} {}'.format(name, format_labels(labels), value[-1]))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+    def _before_request(self):
+        self.start_flusher()
+        g.metrics_started = time.perf_counter()
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unknown'
+        self.inc('http_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)})
+        self.observe('http_request_duration_seconds', {'endpoint': endpoint, 'method': request.method}, time.perf_counter() - started)
+        if not response.is_streamed:
+            self.observe('http_response_size_bytes', {'endpoint': endpoint}, response.calculate_content_length() or 0)
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_started'].pop()
+        endpoint = (request.endpoint or 'unknown') if has_request_context() else 'none'
+        self.inc('sql_statements_total', {'endpoint': endpoint})
+        self.observe('sql_statement_duration_seconds', {'endpoint': endpoint}, time.perf_counter() - started)
+
+    def _handle_error(self, context):
+        # a failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.connection.info.get('metrics_started'):
+            context.connection.info['metrics_started'].pop()
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+
+def add_snapshot(totals, snapshot):
+    for name, labels, value in snapshot:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if isinstance(value, list):
+            current = totals.setdefault(key, [0] * len(value))
+            totals[key] = [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _snapshot_pid(path):
+    # metrics-<pid>-<started ms>.json
+    return int(os.path.basename(path).split('-')[1])
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+metrics = Metrics(
+    directory=os.getenv("METRICS_DIR"),
+    flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", 1.0)),
+)
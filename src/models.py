@@ -1,8 +1,16 @@
+from itertools import chain
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, inspect, literal, select, union_all
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.interfaces import ONETOMANY
 
 db = SQLAlchemy()
 
 class User(db.Model):
+    public_fields = ('id', 'email')
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(80), unique=False, )
@@ -17,17 +25,24 @@ class User(db.Model):
             "email": self.email,
             # do not serialize the password, its a security breach
         }
-    
-    
+
+
 class Planet(db.Model):
     __tablename__ = 'planets'
+    public_fields = ('id', 'name', 'population')
+    filterable = ('name', 'population')
+    sortable = ('id', 'name', 'population')
+    # keyset pages sorted by a column scan (column, id); name is unique, so its own index does that
+    __table_args__ = (
+        db.Index('ix_planets_population_id', 'population', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(25), unique=True)
     population = db.Column(db.Integer)
     characters = db.relationship('Character', back_populates='planet')
 
     def __repr__(self):
-        return 'Planeta {} con id {}'.format(self.name,self.id)
+        return 'Planeta {} con id {}'.format(self.name, self.id)
 
     def serialize(self):
         return {
@@ -38,33 +53,51 @@ class Planet(db.Model):
 
 class Character(db.Model):
     __tablename__ = 'characters'
+    public_fields = ('id', 'name', 'height', 'mass')
+    filterable = ('name', 'height', 'mass', 'planet_id')
+    sortable = ('id', 'name', 'height', 'mass')
+    # serialized key -> relationship attribute
+    relations = {'planet': 'planet'}
+    __table_args__ = (
+        db.Index('ix_characters_height_id', 'height', 'id'),
+        db.Index('ix_characters_mass_id', 'mass', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(25), unique=True)
     height = db.Column(db.Integer)
     mass = db.Column(db.Integer)
-    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'))
+    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), index=True)
     planet = db.relationship('Planet', back_populates='characters')
 
     def __repr__(self):
-        return 'Personaje {} con id {}'.format(self.name,self.id)
+        return 'Personaje {} con id {}'.format(self.name, self.id)
 
     def serialize(self):
-        return {
+        data = {
             "id": self.id,
             "name": self.name,
             "height": self.height,
             "mass": self.mass,
-            "planet": self.planet.serialize(),
         }
-    
+        # deleting a planet leaves its characters without one; left out, like SparseFields does
+        if self.planet is not None:
+            data["planet"] = self.planet.serialize()
+        return data
+
 class Vehicle(db.Model):
     __tablename__ = 'vehicles'
+    public_fields = ('id', 'name', 'type')
+    filterable = ('name', 'type')
+    sortable = ('id', 'name', 'type')
+    __table_args__ = (
+        db.Index('ix_vehicles_type_id', 'type', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(20), unique=True)
     type = db.Column(db.String(25))
 
     def __repr__(self):
-        return 'Vehiculo {} con id {}'.format(self.name,self.id)
+        return 'Vehiculo {} con id {}'.format(self.name, self.id)
 
     def serialize(self):
         return {
@@ -75,11 +108,23 @@ class Vehicle(db.Model):
 
 class Favorite(db.Model):
     __tablename__ = "favorite"
+    public_fields = ('id', 'user_id')
+    filterable = ('user_id', 'planet_id', 'vehicles_id', 'characters_id')
+    sortable = ('id', 'user_id')
+    relations = {'planet': 'planet', 'vehicle': 'Vehicle', 'character': 'Character'}
+    # one favorite per user and item; NULLs never collide, so each index only constrains its own type.
+    # user_id leads all three, so they also serve the lookups by user
+    __table_args__ = (
+        db.Index('uq_favorite_user_planet', 'user_id', 'planet_id', unique=True),
+        db.Index('uq_favorite_user_vehicle', 'user_id', 'vehicles_id', unique=True),
+        db.Index('uq_favorite_user_character', 'user_id', 'characters_id', unique=True),
+        db.Index('ix_favorite_user_id_id', 'user_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    vehicles_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=True)
-    characters_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=True)
-    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=True)
+    vehicles_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=True, index=True)
+    characters_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=True, index=True)
+    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=True, index=True)
     user = db.relationship('User', backref='favorite')
     planet = db.relationship('Planet', backref='favorite')
     Vehicle = db.relationship('Vehicle', backref='favorite')
@@ -89,18 +134,149 @@ class Favorite(db.Model):
         return f'Favorite(id={self.id}, user_id={self.user_id}, planet_id={self.planet_id})'
 
     def serialize(self):
-       data = {
+        data = {
             "id": self.id,
             "user_id": self.user_id,
-       }
+        }
+
+        if self.planet:
+            data["planet"] = self.planet.serialize()
+
+        if self.Vehicle:
+            data["vehicle"] = self.Vehicle.serialize()
+
+        if self.Character:
+            data["character"] = self.Character.serialize()
+
+        return data
+
+
+# Eager loading for the relationships touched by serialize(), so list endpoints
+# run a constant number of queries instead of one per row
+CHARACTER_LOAD = (joinedload(Character.planet),)
+FAVORITE_LOAD = (
+    joinedload(Favorite.planet),
+    joinedload(Favorite.Vehicle),
+    joinedload(Favorite.Character).joinedload(Character.planet),
+)
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_version'
+    name = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return 'Version {} de la tabla {}'.format(self.version, self.name)
+
+    @classmethod
+    def bump(cls, *names, session=None):
+        # runs inside the caller's transaction, so the version only moves if the write commits
+        session = session or db.session
+        for name in names:
+            updated = session.query(cls).filter_by(name=name).update({cls.version: cls.version + 1}, synchronize_session=False)
+            if not updated:
+                session.add(cls(name=name, version=1))
+
+    @classmethod
+    def etag(cls, *names):
+        versions = dict(db.session.query(cls.name, cls.version).filter(cls.name.in_(names)).all())
+        return '-'.join('{}.{}'.format(name, versions.get(name, 0)) for name in names)
+
+class FavoriteCount(db.Model):
+    """Favorites per item, kept up to date by the favorite handlers so /favorites/top never scans favorite."""
+    __tablename__ = 'favorite_count'
+    # favorite type -> favorite column
+    columns = {'planet': 'planet_id', 'vehicle': 'vehicles_id', 'character': 'characters_id'}
+    # serves WHERE type = ? ORDER BY count DESC, item_id DESC LIMIT n as a backwards index scan
+    __table_args__ = (
+        db.Index('ix_favorite_count_top', 'type', 'count', 'item_id'),
+    )
+    type = db.Column(db.String(20), primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '{} favoritos de {} {}'.format(self.count, self.type, self.item_id)
+
+    @classmethod
+    def item(cls, row):
+        """(type, item id) of a favorite or of its (planet_id, vehicles_id, characters_id) columns."""
+        for type, column in cls.columns.items():
+            item_id = getattr(row, column)
+            if item_id is not None:
+                return type, item_id
+        return None
+
+    @classmethod
+    def change(cls, deltas):
+        """Apply {(type, item_id): delta}; runs inside the caller's transaction, like TableVersion.bump.
+
+        One upsert for every item, so a batch doesn't cost a statement per item and two requests
+        adding the first favorite of the same item don't both try to insert its row.
+        """
+        rows = [{'type': type, 'item_id': item_id, 'count': delta} for (type, item_id), delta in deltas.items() if delta]
+        if not rows:
+            return
+        backend = db.session.get_bind().dialect.name
+        if backend in ('sqlite', 'postgresql'):
+            insert = (sqlite_insert if backend == 'sqlite' else postgresql_insert)(cls.__table__)
+            statement = insert.on_conflict_do_update(index_elements=['type', 'item_id'], set_={'count': cls.count + insert.excluded['count']})
+        elif backend == 'mysql':
+            insert = mysql_insert(cls.__table__)
+            statement = insert.on_duplicate_key_update(count=cls.count + insert.inserted['count'])
+        else:
+            for row in rows:
+                updated = cls.query.filter_by(type=row['type'], item_id=row['item_id']).update({cls.count: cls.count + row['count']}, synchronize_session=False)
+                if not updated:
+                    db.session.add(cls(**row))
+            return
+        db.session.execute(statement, rows)
+
+    @classmethod
+    def forget(cls, type, item_id):
+        cls.query.filter_by(type=type, item_id=item_id).delete(synchronize_session=False)
+
+    @classmethod
+    def top(cls, types, limit):
+        """(type, item_id, count) of the `limit` most favorited items of every type, one index scan per type in one statement."""
+        tops = [
+            select(cls.type, cls.item_id, cls.count).where(cls.type == type, cls.count > 0)
+            .order_by(cls.count.desc(), cls.item_id.desc()).limit(limit).subquery()
+            for type in types
+        ]
+        return db.session.execute(union_all(*(select(top) for top in tops))).all()
+
+    @classmethod
+    def rebuild(cls):
+        """Recount from the favorite table, e.g. after a bulk load or to repair drift."""
+        cls.query.delete(synchronize_session=False)
+        for type, name in cls.columns.items():
+            column = getattr(Favorite, name)
+            counts = select(literal(type), column, func.count()).where(column.isnot(None)).group_by(column)
+            db.session.execute(cls.__table__.insert().from_select(['type', 'item_id', 'count'], counts))
 
-       if self.planet:
-           data["planet"] = self.planet.serialize()
 
-       if self.Vehicle:
-           data["vehicle"] = self.Vehicle.serialize()
+# tables whose writes move their TableVersion, read by the ETags and the cache keys
+VERSIONED_TABLES = frozenset(('user', 'planets', 'characters', 'vehicles', 'favorite'))
 
-       if self.Character:
-           data["character"] = self.Character.serialize()
+# Versions are bumped from the session, so every write path moves them: the handlers, Flask-Admin,
+# the seed command and anything else going through db.session
+@event.listens_for(db.session, 'before_flush')
+def bump_flushed_tables(session, flush_context, instances):
+    tables = set()
+    for instance in chain(session.new, session.dirty, session.deleted):
+        tables.add(instance.__tablename__)
+    for instance in session.deleted:
+        # deleting a parent nulls the foreign keys of its loaded children
+        for relationship in inspect(instance).mapper.relationships:
+            if relationship.direction is ONETOMANY:
+                tables.add(relationship.mapper.local_table.name)
+    TableVersion.bump(*sorted(tables & VERSIONED_TABLES), session=session)
 
-       return data
\ No newline at end of file
+@event.listens_for(db.session, 'do_orm_execute')
+def bump_executed_table(state):
+    # bulk statements that skip the flush: executemany inserts, Query.update() and Query.delete()
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, 'table', None)
+        if table is not None and table.name in VERSIONED_TABLES:
+            TableVersion.bump(table.name, session=state.session)
@@ -0,0 +1,124 @@
+import logging
+import os
+import re
+import time
+import traceback
+from collections import Counter
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\bIN \((?:\?|%\(\w+\)s|:\w+|, )+\)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+
+class QueryProblem(AssertionError):
+    """Raised in strict mode so a route that regresses fails the test that exercised it."""
+
+
+def fingerprint(statement):
+    statement = _LITERALS.sub('?', statement)
+    statement = _IN_LISTS.sub('IN (...)', statement)
+    return _SPACES.sub(' ', statement).strip()
+
+
+def call_site():
+    # innermost frame in our own code, e.g. the serialize() that triggered a lazy load
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if frame.filename.startswith(HERE) and not frame.filename.endswith(os.path.basename(__file__)):
+            return '{}:{} in {}'.format(os.path.relpath(frame.filename, HERE), frame.lineno, frame.name)
+    return 'unknown'
+
+
+class QueryDetector:
+    """Development-time detector of N+1 query patterns and slow statements.
+
+    Every statement run during a request is fingerprinted (literals and IN lists stripped). The same
+    lazy load (a relationship or an unloaded column read off an instance) issued n1_threshold times
+    or more is reported as an N+1; statements the code runs itself, like query_in_chunks() batches,
+    may repeat freely. Any statement slower than slow_ms is reported as slow. Findings are logged with the endpoint and call site; in strict mode
+    they also raise QueryProblem. Queries issued while a streamed body is being sent are not seen.
+    """
+
+    def __init__(self, mode='off', n1_threshold=3, slow_ms=100.0):
+        self.mode = mode
+        self.n1_threshold = n1_threshold
+        self.slow_ms = slow_ms
+
+    def init_app(self, app, db):
+        if self.mode not in ('log', 'strict'):
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+        event.listen(db.session, 'do_orm_execute', self._do_orm_execute)
+
+    def findings(self, queries):
+        found = []
+        counts = Counter(statement for statement, _, _, lazy in queries if lazy)
+        sites = {}
+        for statement, _, site, _ in queries:
+            sites.setdefault(statement, site)
+        for statement, count in counts.items():
+            if count >= self.n1_threshold:
+                found.append('N+1: {} ejecuciones de "{}" desde {}'.format(count, statement, sites[statement]))
+        for statement, duration, site, _ in queries:
+            if duration * 1000 > self.slow_ms:
+                found.append('Consulta lenta ({:.1f} ms): "{}" desde {}'.format(duration * 1000, statement, site))
+        return found
+
+    def _before_request(self):
+        g.query_log = []
+        g.query_lazy_load = False
+
+    def _after_request(self, response):
+        queries = g.pop('query_log', None)
+        if not queries:
+            return response
+        found = self.findings(queries)
+        for finding in found:
+            logger.warning('%s %s: %s', request.method, request.endpoint, finding)
+        if found and self.mode == 'strict':
+            raise QueryProblem('{} {}:\n{}'.format(request.method, request.endpoint, '\n'.join(found)))
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_detector_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_detector_started'].pop()
+        if has_request_context() and 'query_log' in g:
+            g.query_log.append((fingerprint(statement), duration, call_site(), g.query_lazy_load))
+
+    def _do_orm_execute(self, state):
+        if not has_request_context() or 'query_log' not in g or not isinstance(state.statement, Select):
+            return None
+        if not (state.is_relationship_load or state.is_column_load):
+            return None
+        # run the load here so the statements it sends are marked as lazy
+        g.query_lazy_load = True
+        try:
+            return state.invoke_statement()
+        finally:
+            g.query_lazy_load = False
+
+    def _handle_error(self, context):
+        if context.connection is not None and context.connection.info.get('query_detector_started'):
+            context.connection.info['query_detector_started'].pop()
+
+
+query_detector = QueryDetector(
+    mode=os.getenv("QUERY_DETECTOR", "off"),
+    n1_threshold=int(os.getenv("QUERY_DETECTOR_N1_THRESHOLD", 3)),
+    slow_ms=float(os.getenv("QUERY_DETECTOR_SLOW_MS", 100)),
+)
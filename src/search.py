@@ -0,0 +1,153 @@
+import re
+
+from sqlalchemy import bindparam, event, text
+
+from models import db, Planet, Character, Vehicle
+
+# entity type -> (model, code); search_index rows use id * 4 + code as their key, so a row can be
+# replaced or deleted by primary key (FTS5 cannot index the entity columns themselves)
+ENTITIES = {
+    'planet': (Planet, 1),
+    'character': (Character, 2),
+    'vehicle': (Vehicle, 3),
+}
+
+_TOKENS = re.compile(r'\w+', re.UNICODE)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keeps autogenerate from dropping search_index (and the FTS5 shadow tables), which live outside the models."""
+    return not (type_ == 'table' and name.startswith('search_index'))
+
+
+def entity_of(model):
+    return next(entity for entity, (entity_model, _) in ENTITIES.items() if entity_model is model)
+
+
+def dialect():
+    return db.session.get_bind().dialect.name
+
+
+def row_key(entity, entity_id):
+    return entity_id * 4 + ENTITIES[entity][1]
+
+
+def index_many(entity, rows):
+    """Add or replace (id, name) rows of one entity type; runs in the caller's transaction."""
+    rows = [{'key': row_key(entity, id), 'entity': entity, 'entity_id': id, 'name': name or ''} for id, name in rows]
+    if not rows:
+        return
+    backend = dialect()
+    if backend == 'sqlite':
+        db.session.execute(text('DELETE FROM search_index WHERE rowid = :key'), rows)
+        db.session.execute(text('INSERT INTO search_index (rowid, name, entity, entity_id) VALUES (:key, :name, :entity, :entity_id)'), rows)
+    elif backend == 'postgresql':
+        db.session.execute(text(
+            "INSERT INTO search_index (id, entity, entity_id, name, document) "
+            "VALUES (:key, :entity, :entity_id, :name, to_tsvector('simple', :name)) "
+            "ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, document = EXCLUDED.document"
+        ), rows)
+
+
+def index(entity, entity_id, name):
+    index_many(entity, [(entity_id, name)])
+
+
+def remove(entity, entity_id):
+    backend = dialect()
+    if backend == 'sqlite':
+        db.session.execute(text('DELETE FROM search_index WHERE rowid = :key'), {'key': row_key(entity, entity_id)})
+    elif backend == 'postgresql':
+        db.session.execute(text('DELETE FROM search_index WHERE id = :key'), {'key': row_key(entity, entity_id)})
+
+
+def search(q, types, limit):
+    """Ranked name search; every word of q matches as a prefix. Returns [{'type', 'id', 'name'}].
+
+    Every match is ranked before the limit is applied, so an exact name can't be cut off by a
+    common prefix; ties go to the shortest name.
+    """
+    tokens = _TOKENS.findall(q.lower())
+    if not tokens:
+        return []
+    backend = dialect()
+    params = {'limit': limit, 'types': list(types)}
+    if backend == 'sqlite':
+        params['q'] = ' '.join('"{}"*'.format(token) for token in tokens)
+        statement = text(
+            'SELECT entity, entity_id, name FROM search_index '
+            'WHERE search_index MATCH :q AND entity IN :types '
+            'ORDER BY rank, length(name), rowid LIMIT :limit'
+        )
+    elif backend == 'postgresql':
+        params['q'] = ' & '.join('{}:*'.format(token) for token in tokens)
+        statement = text(
+            "SELECT entity, entity_id, name FROM search_index, to_tsquery('simple', :q) query "
+            "WHERE document @@ query AND entity IN :types "
+            "ORDER BY ts_rank(document, query) DESC, length(name), id LIMIT :limit"
+        )
+    else:
+        return like_search(tokens, types, limit)
+    statement = statement.bindparams(bindparam('types', expanding=True))
+    return [{'type': entity, 'id': entity_id, 'name': name} for entity, entity_id, name in db.session.execute(statement, params)]
+
+
+def like_search(tokens, types, limit):
+    # databases without a full-text index: prefix match on the first word, shortest names first
+    results = []
+    for entity in types:
+        model = ENTITIES[entity][0]
+        query = db.session.query(model.id, model.name).filter(model.name.ilike(tokens[0] + '%'))
+        for token in tokens[1:]:
+            query = query.filter(model.name.ilike('%' + token + '%'))
+        results.extend({'type': entity, 'id': id, 'name': name} for id, name in query.limit(limit))
+    return sorted(results, key=lambda result: len(result['name']))[:limit]
+
+
+def create_index(connection=None):
+    """Create search_index if it's missing; runs on connection, or on the session when none is given."""
+    executor = connection if connection is not None else db.session
+    backend = connection.dialect.name if connection is not None else dialect()
+    if backend == 'sqlite':
+        executor.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            "name, entity UNINDEXED, entity_id UNINDEXED, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+    elif backend == 'postgresql':
+        executor.execute(text(
+            'CREATE TABLE IF NOT EXISTS search_index ('
+            'id BIGINT PRIMARY KEY, entity VARCHAR(20) NOT NULL, entity_id INTEGER NOT NULL, '
+            'name TEXT NOT NULL, document TSVECTOR NOT NULL)'
+        ))
+        executor.execute(text('CREATE INDEX IF NOT EXISTS ix_search_index_document ON search_index USING GIN (document)'))
+
+
+# search_index isn't part of the models' metadata, so a database built with db.create_all() (tests,
+# benchmarks, a quick local setup without migrations) would lack it and every write would fail
+@event.listens_for(db.metadata, 'after_create')
+def create_index_with_tables(target, connection, **kw):
+    create_index(connection)
+
+
+@event.listens_for(db.metadata, 'after_drop')
+def drop_index_with_tables(target, connection, **kw):
+    if connection.dialect.name in ('sqlite', 'postgresql'):
+        connection.execute(text('DROP TABLE IF EXISTS search_index'))
+
+
+def rebuild(batch_size=10000):
+    """Recreate search_index from the catalog tables, e.g. after bulk loads that bypass the handlers."""
+    create_index()
+    db.session.execute(text('DELETE FROM search_index'))
+    total = 0
+    for entity, (model, _) in ENTITIES.items():
+        last_id = 0
+        while True:
+            rows = db.session.query(model.id, model.name).filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            index_many(entity, rows)
+            total += len(rows)
+            last_id = rows[-1][0]
+    db.session.commit()
+    return total
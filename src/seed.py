@@ -0,0 +1,191 @@
+"""
+`flask seed` loads the catalog from files instead of POSTing rows one by one.
+
+    $ pipenv run flask seed data/planets.csv data/characters.ndjson data/favorites.json
+    $ pipenv run flask seed data/            # every <resource>.{json,ndjson,jsonl,csv} inside
+
+The resource comes from the file name (users, planets, vehicles, characters, favorites) and they
+are always loaded in that order, one transaction each. References can be given by id or by name:
+a character's `planet`, and a favorite's `user` (email), `planet`, `vehicle` and `character`.
+Any other key that isn't a column of the table stops the load.
+"""
+import csv
+import io
+import json
+import os
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Boolean, Integer, text
+
+import search
+from cache import entity_cache
+from models import db, User, Planet, Character, Vehicle, Favorite, FavoriteCount, TableVersion
+
+# resource -> (model, {record key: (column, referenced model, lookup column)})
+RESOURCES = {
+    'users': (User, {}),
+    'planets': (Planet, {}),
+    'vehicles': (Vehicle, {}),
+    'characters': (Character, {'planet': ('planet_id', Planet, 'name')}),
+    'favorites': (Favorite, {
+        'user': ('user_id', User, 'email'),
+        'planet': ('planet_id', Planet, 'name'),
+        'vehicle': ('vehicles_id', Vehicle, 'name'),
+        'character': ('characters_id', Character, 'name'),
+    }),
+}
+EXTENSIONS = ('.json', '.ndjson', '.jsonl', '.csv')
+TRUE = ('1', 'true', 't', 'yes')
+
+
+def read_records(path):
+    """Yield one dict per record; JSON files hold an array (or {"result": [...]}), NDJSON one object per line."""
+    extension = os.path.splitext(path)[1]
+    with open(path, newline='' if extension == '.csv' else None, encoding='utf-8') as f:
+        if extension == '.csv':
+            yield from csv.DictReader(f)
+        elif extension == '.json':
+            records = json.load(f)
+            yield from records['result'] if isinstance(records, dict) else records
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def find_files(paths):
+    files = {}
+    for path in paths:
+        candidates = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+        for candidate in candidates:
+            resource, extension = os.path.splitext(os.path.basename(candidate))
+            if extension not in EXTENSIONS:
+                continue
+            if resource not in RESOURCES:
+                raise click.ClickException('No sé qué recurso contiene {}; usa {}'.format(candidate, ', '.join(RESOURCES)))
+            files.setdefault(resource, []).append(candidate)
+    return files
+
+
+class Loader:
+    def __init__(self, batch_size=10000, use_copy=True):
+        self.batch_size = batch_size
+        self.postgres = db.session.get_bind().dialect.name == 'postgresql'
+        self.use_copy = use_copy and self.postgres
+        self._lookups = {}
+
+    def lookup(self, model, field):
+        # name -> id for a whole table, read once; seeded tables are dropped from here after loading
+        key = (model.__tablename__, field)
+        if key not in self._lookups:
+            self._lookups[key] = dict(db.session.query(getattr(model, field), model.id))
+        return self._lookups[key]
+
+    def rows(self, resource, path):
+        model, references = RESOURCES[resource]
+        columns = {column.name: column for column in model.__table__.columns}
+        for line, record in enumerate(read_records(path), start=1):
+            row = {}
+            for key, value in record.items():
+                if value == '' and path.endswith('.csv'):
+                    value = None
+                if key in references and value is not None:
+                    column, referenced, field = references[key]
+                    resolved = self.lookup(referenced, field).get(value)
+                    if resolved is None:
+                        raise click.ClickException('{}:{}: no existe {} {!r}'.format(path, line, referenced.__tablename__, value))
+                    row[column] = resolved
+                elif key in columns:
+                    row[key] = self.coerce(columns[key], value, path, line)
+                else:
+                    # a typo in a header would otherwise load the whole file with that column NULL
+                    raise click.ClickException('{}:{}: columna desconocida {!r}; usa {}'.format(
+                        path, line, key, ', '.join(list(columns) + list(references))))
+            yield row
+
+    def coerce(self, column, value, path, line):
+        if not isinstance(value, str):
+            return value
+        try:
+            if isinstance(column.type, Boolean):
+                return value.lower() in TRUE
+            if isinstance(column.type, Integer):
+                return int(value)
+        except ValueError:
+            raise click.ClickException('{}:{}: {} debe ser un entero'.format(path, line, column.name))
+        return value
+
+    def load(self, resource, paths):
+        model = RESOURCES[resource][0]
+        table = model.__table__
+        total = 0
+        for path in paths:
+            batch = []
+            for row in self.rows(resource, path):
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    total += self.insert(table, batch)
+                    batch = []
+            if batch:
+                total += self.insert(table, batch)
+        if self.postgres:
+            # rows that brought their own id leave the serial sequence behind
+            db.session.execute(text(
+                "SELECT setval(pg_get_serial_sequence(:table, 'id'), COALESCE(MAX(id), 1)) FROM {}".format(table.name)
+            ), {'table': table.name})
+        TableVersion.bump(table.name)
+        db.session.commit()
+        entity_cache.invalidate((table.name, '*'))
+        for key in [key for key in self._lookups if key[0] == table.name]:
+            del self._lookups[key]
+        return total
+
+    def insert(self, table, batch):
+        # the batch shares one column list, missing keys become NULL
+        names = [column.name for column in table.columns if any(column.name in row for row in batch)]
+        if not self.use_copy:
+            db.session.execute(table.insert(), [{name: row.get(name) for name in names} for row in batch])
+            return len(batch)
+        buffer = io.StringIO()
+        # strings are quoted, so an empty string stays '' and only None becomes NULL
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for row in batch:
+            writer.writerow([row.get(name) for name in names])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table.name, ', '.join(names)), buffer)
+        cursor.close()
+        return len(batch)
+
+
+@click.command('seed')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--batch-size', default=10000, show_default=True, help='Filas por INSERT/COPY.')
+@click.option('--copy/--no-copy', 'use_copy', default=True, help='Usar COPY en Postgres.')
+@with_appcontext
+def seed_command(paths, batch_size, use_copy):
+    """Load users, planets, vehicles, characters and favorites from JSON, NDJSON or CSV files."""
+    files = find_files(paths)
+    if not files:
+        raise click.ClickException('No hay ficheros {} que cargar'.format('/'.join(EXTENSIONS)))
+    loader = Loader(batch_size, use_copy)
+    started = time.perf_counter()
+    total = 0
+    for resource in RESOURCES:
+        if resource not in files:
+            continue
+        resource_started = time.perf_counter()
+        count = loader.load(resource, files[resource])
+        elapsed = time.perf_counter() - resource_started
+        total += count
+        click.echo('{}: {} filas en {:.1f}s ({:.0f} filas/s)'.format(resource, count, elapsed, count / elapsed if elapsed else 0))
+    if 'favorites' in files:
+        FavoriteCount.rebuild()
+        db.session.commit()
+        click.echo('favorite_count: contadores recalculados')
+    if files.keys() & {'planets', 'characters', 'vehicles'}:
+        click.echo('search: {} nombres indexados'.format(search.rebuild()))
+    elapsed = time.perf_counter() - started
+    click.echo('Total: {} filas en {:.1f}s ({:.0f} filas/s)'.format(total, elapsed, total / elapsed if elapsed else 0))
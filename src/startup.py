@@ -0,0 +1,118 @@
+"""
+Worker boot cost: what importing app.py spends its time on and how long a fresh process takes to
+answer its first request, for each ADMIN mode.
+
+    $ pipenv run startup                 # import profile + time to first request, 5 runs per mode
+    $ pipenv run startup --runs 10 --top 15 --out startup.json
+
+Every measurement runs in a new interpreter, so nothing is already imported or cached.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = ('eager', 'lazy', 'off')
+
+# runs in the child: import the app, then time one real request through the full WSGI stack
+FIRST_REQUEST = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/planets')
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'first_request_ms': (done - imported) * 1000}))
+"""
+
+_IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def child_env(database_url, admin):
+    env = dict(os.environ, DATABASE_URL=database_url, ADMIN=admin, PYTHONDONTWRITEBYTECODE='1')
+    env.pop('FLASK_APP', None)
+    return env
+
+
+def import_profile(database_url, admin, top):
+    """`python -X importtime -c 'import app'`: the modules app.py imports directly, by cumulative time."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=HERE, env=child_env(database_url, admin), capture_output=True, text=True, check=True,
+    )
+    modules = []
+    total = None
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        if name == 'app' and not indent:
+            total = int(cumulative_us) / 1000
+        elif len(indent) == 2:
+            modules.append({'module': name, 'cumulative_ms': int(cumulative_us) / 1000, 'self_ms': int(self_us) / 1000})
+    modules.sort(key=lambda module: module['cumulative_ms'], reverse=True)
+    return {'admin': admin, 'total_ms': total, 'modules': modules[:top]}
+
+
+def first_request(database_url, admin, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', FIRST_REQUEST],
+            cwd=HERE, env=child_env(database_url, admin), capture_output=True, text=True, check=True,
+        )
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample['process_ms'] = (time.perf_counter() - started) * 1000
+        samples.append(sample)
+    return {
+        'admin': admin,
+        'runs': runs,
+        **{key: round(statistics.median(sample[key] for sample in samples), 1) for key in ('import_ms', 'first_request_ms', 'process_ms')},
+    }
+
+
+def create_database(path):
+    subprocess.run(
+        [sys.executable, '-c', 'import app\nwith app.app.app_context(): app.db.create_all()'],
+        cwd=HERE, env=child_env('sqlite:///' + path, 'off'), check=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per ADMIN mode')
+    parser.add_argument('--top', type=int, default=10, help='imports listed in the profile')
+    parser.add_argument('--out', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = 'sqlite:///' + os.path.join(directory, 'startup.db')
+        create_database(os.path.join(directory, 'startup.db'))
+        profiles = [import_profile(database_url, mode, args.top) for mode in MODES]
+        timings = [first_request(database_url, mode, args.runs) for mode in MODES]
+
+    for profile in profiles:
+        print('import app (ADMIN={}): {:.0f} ms'.format(profile['admin'], profile['total_ms']))
+        for module in profile['modules']:
+            print('  {:>8.1f} ms  {}'.format(module['cumulative_ms'], module['module']))
+    print()
+    print('{:<8} {:>12} {:>18} {:>12}'.format('ADMIN', 'import ms', 'first request ms', 'process ms'))
+    for timing in timings:
+        print('{:<8} {:>12} {:>18} {:>12}'.format(timing['admin'], timing['import_ms'], timing['first_request_ms'], timing['process_ms']))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'profiles': profiles, 'first_request': timings}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
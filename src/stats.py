@@ -0,0 +1,91 @@
+from sqlalchemy import distinct, func
+
+from models import db, Planet, Character
+
+
+def number(value):
+    # AVG comes back as Decimal on Postgres/MySQL and float on SQLite
+    return round(float(value), 2) if value is not None else None
+
+
+def summary(column):
+    return [func.count(column), func.sum(column), func.avg(column), func.min(column), func.max(column)]
+
+
+def summary_dict(values):
+    count, total, average, low, high = values
+    return {'count': count, 'total': total, 'average': number(average), 'min': low, 'max': high}
+
+
+def histogram(column, low, high, buckets, *criteria):
+    """Equal-width buckets over [low, high] counted with one GROUP BY in the database; empty buckets included."""
+    if low is None:
+        return []
+    width = -(-(high - low + 1) // buckets)
+    offset = column - low
+    # integer division on every backend; MySQL's / always returns a decimal
+    if db.session.get_bind().dialect.name == 'mysql':
+        bucket = offset.op('DIV')(width)
+    else:
+        bucket = offset / width
+    counts = dict(
+        db.session.query(bucket.label('bucket'), func.count())
+        .filter(column.isnot(None), *criteria).group_by('bucket').all()
+    )
+    return [
+        {'from': low + index * width, 'to': min(low + (index + 1) * width - 1, high), 'count': counts.get(index, 0)}
+        for index in range(-(-(high - low + 1) // width))
+    ]
+
+
+def planet_stats(buckets=None):
+    row = db.session.query(func.count(Planet.id), *summary(Planet.population)).one()
+    stats = {'planets': row[0], 'population': summary_dict(row[1:])}
+    if buckets:
+        stats['histogram'] = {'population': histogram(Planet.population, row[4], row[5], buckets)}
+    return stats
+
+
+def character_stats(buckets=None, planet_id=None, limit=100):
+    criteria = [Character.planet_id == planet_id] if planet_id is not None else []
+    row = db.session.query(
+        func.count(Character.id), func.count(distinct(Character.planet_id)),
+        *summary(Character.height), *summary(Character.mass),
+    ).filter(*criteria).one()
+    characters, planets = row[0], row[1]
+    stats = {
+        'characters': characters,
+        'height': summary_dict(row[2:7]),
+        'mass': summary_dict(row[7:12]),
+        'planets': {'with_characters': planets, 'average_characters': number(characters / planets) if planets else None},
+    }
+
+    count = func.count(Character.id)
+    per_planet = (
+        db.session.query(
+            Character.planet_id, Planet.name, count,
+            func.avg(Character.height), func.min(Character.height), func.max(Character.height),
+            func.avg(Character.mass), func.min(Character.mass), func.max(Character.mass),
+        )
+        .outerjoin(Planet, Planet.id == Character.planet_id)
+        .filter(*criteria)
+        .group_by(Character.planet_id, Planet.name)
+        .order_by(count.desc(), Character.planet_id)
+        .limit(limit)
+    )
+    stats['per_planet'] = [
+        {
+            'planet': {'id': planet, 'name': name},
+            'characters': total,
+            'height': {'average': number(height_avg), 'min': height_min, 'max': height_max},
+            'mass': {'average': number(mass_avg), 'min': mass_min, 'max': mass_max},
+        }
+        for planet, name, total, height_avg, height_min, height_max, mass_avg, mass_min, mass_max in per_planet
+    ]
+
+    if buckets:
+        stats['histogram'] = {
+            'height': histogram(Character.height, row[5], row[6], buckets, *criteria),
+            'mass': histogram(Character.mass, row[10], row[11], buckets, *criteria),
+        }
+    return stats
@@ -1,4 +1,14 @@
-from flask import jsonify, url_for
+import csv
+import io
+import re
+from functools import wraps
+from itertools import chain
+from flask import jsonify, url_for, request, current_app, stream_with_context, make_response
+from sqlalchemy import Integer, select, tuple_
+from sqlalchemy.orm import aliased
+from models import db, TableVersion
+from cache import entity_cache
+from compression import matching_etag
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +25,366 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def get_page_args():
+    max_size = current_app.config['API_MAX_PAGE_SIZE']
+    limit = request.args.get('limit', current_app.config['API_DEFAULT_PAGE_SIZE'])
+    after = request.args.get('after')
+    try:
+        limit = int(limit)
+        after = int(after) if after is not None else None
+    except ValueError:
+        raise APIException('Los parámetros limit y after deben ser enteros', status_code=400)
+    if limit < 1:
+        raise APIException('El parámetro limit debe ser mayor que 0', status_code=400)
+    return min(limit, max_size), after
+
+def get_filters(query, model):
+    """?<column>=, ?<column>_min=, ?<column>_max= (integers) and ?<column>_prefix= (strings) on model.filterable."""
+    columns = model.__table__.columns
+    for key, value in request.args.items():
+        name, operator = key, None
+        for suffix in ('_min', '_max', '_prefix'):
+            if key.endswith(suffix) and key[:-len(suffix)] in columns:
+                name, operator = key[:-len(suffix)], suffix
+        if name not in columns:
+            continue
+        if name not in getattr(model, 'filterable', ()):
+            raise APIException('No se puede filtrar por {}'.format(name), status_code=400)
+        column = getattr(model, name)
+        numeric = isinstance(column.type, Integer)
+        if operator == '_prefix':
+            if numeric:
+                raise APIException('El filtro {} solo aplica a textos'.format(key), status_code=400)
+            query = query.filter(*prefix_range(column, value))
+            continue
+        if numeric:
+            try:
+                value = int(value)
+            except ValueError:
+                raise APIException('El filtro {} debe ser un entero'.format(key), status_code=400)
+        elif operator is not None:
+            raise APIException('El filtro {} solo aplica a enteros'.format(key), status_code=400)
+        if operator == '_min':
+            query = query.filter(column >= value)
+        elif operator == '_max':
+            query = query.filter(column <= value)
+        else:
+            query = query.filter(column == value)
+    return query
+
+def prefix_range(column, prefix):
+    """Conditions for `column` starting with `prefix`.
+
+    LIKE 'abc%' only becomes an index range on some databases and collations, so the index is
+    searched with column >= 'abc' AND column < 'abd' and the LIKE only rechecks those rows.
+    """
+    conditions = [column.isnot(None)]
+    upper = prefix.rstrip(chr(0x10FFFF))
+    if prefix:
+        conditions.append(column >= prefix)
+    if upper:
+        conditions.append(column < upper[:-1] + chr(ord(upper[-1]) + 1))
+    conditions.append(column.startswith(prefix, autoescape=True))
+    return conditions
+
+def get_sort(model):
+    """?sort=<column> or ?sort=-<column> on model.sortable; None means primary key order."""
+    sort = request.args.get('sort', 'id')
+    descending = sort.startswith('-')
+    name = sort.lstrip('-')
+    if name not in getattr(model, 'sortable', ('id',)):
+        raise APIException('No se puede ordenar por {}'.format(name), status_code=400)
+    if name == 'id':
+        return None, descending
+    return getattr(model, name), descending
+
+def keyset(query, model, after):
+    """Filter, order and position `query` after the row with id `after`, for any whitelisted sort.
+
+    Returns the queries to read in turn: the rows with a value ordered by (column, id), then, for a
+    nullable column, the NULLs by id, so NULLs go last on every database. The cursor is compared
+    as a row value, (column, id) > (value, after), so each part is one range scan on the
+    (column, id) index. The cursor stays a plain id and its sort value is read with one primary key lookup.
+    """
+    query = get_filters(query, model)
+    column, descending = get_sort(model)
+    order = (lambda expression: expression.desc()) if descending else (lambda expression: expression)
+    past = (lambda left, right: left < right) if descending else (lambda left, right: left > right)
+    if column is None:
+        if after is not None:
+            query = query.filter(past(model.id, after))
+        return [query.order_by(order(model.id))]
+
+    values = query.filter(column.isnot(None))
+    nulls = query.filter(column.is_(None))
+    if after is not None:
+        cursor = model.query.with_entities(column).filter(model.id == after).first()
+        if cursor is None:
+            raise APIException('El cursor after no corresponde a ningún registro', status_code=400)
+        value = cursor[0]
+        if value is None:
+            values = None
+            nulls = nulls.filter(past(model.id, after))
+        else:
+            values = values.filter(past(tuple_(column, model.id), tuple_(value, after)))
+    parts = []
+    if values is not None:
+        parts.append(values.order_by(order(column), order(model.id)))
+    if model.__table__.columns[column.key].nullable:
+        parts.append(nulls.order_by(order(model.id)))
+    return parts
+
+def paginate(query, model):
+    """Keyset pagination: WHERE <past the cursor row> ORDER BY <sort>, id LIMIT n, never OFFSET."""
+    limit, after = get_page_args()
+    # fetch one extra row to know whether there is a next page
+    rows = []
+    for part in keyset(query, model, after):
+        rows.extend(part.limit(limit + 1 - len(rows)).all())
+        if len(rows) > limit:
+            break
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return rows, next_cursor
+
+def table_versions(*tables):
+    """TableVersion.etag(*tables), read once per request and shared by the ETag and the cache keys."""
+    # kept on the request rather than g, which outlives it when an app context is already pushed
+    versions = request.environ.setdefault('api.table_versions', {})
+    if tables not in versions:
+        versions[tables] = TableVersion.etag(*tables)
+    return versions[tables]
+
+def cache_key(tables, *parts):
+    """entity_cache key that carries the versions of `tables`.
+
+    A write in any worker bumps the version, so entries cached before it (in this process, or stored
+    by a request that raced the write) stop matching instead of being served stale.
+    """
+    return (table_versions(*tables),) + parts
+
+def page_params(model):
+    """The query parameters a page depends on, sorted; anything else (cache busters, tracking tags) is left out of the key."""
+    names = {'limit', 'after', 'sort'}
+    for name in getattr(model, 'filterable', ()):
+        names.update(name + suffix for suffix in ('', '_min', '_max', '_prefix'))
+    return tuple(sorted(
+        (key, value) for key, value in request.args.items()
+        if key in names or SparseFields.param.match(key)
+    ))
+
+def cached_page(query, model, serialize, tables):
+    """paginate() through entity_cache, keyed by the path, the page parameters and the versions of `tables`."""
+    def load():
+        rows, next_cursor = paginate(query, model)
+        return {'result': [serialize(row) for row in rows], 'next': next_cursor}
+    key = cache_key(tables, 'page', request.path, *page_params(model))
+    return entity_cache.fetch(key, load, depends_on=lambda page: [(table, '*') for table in tables])
+
+def wants_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+def stream_json(query, model, serialize):
+    """Chunked {'msg': 'ok', 'result': [...]} body, one row at a time, batched with yield_per."""
+    after = request.args.get('after')
+    try:
+        after = int(after) if after is not None else None
+    except ValueError:
+        raise APIException('El parámetro after debe ser un entero', status_code=400)
+    batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+    query = chain.from_iterable(part.yield_per(batch_size) for part in keyset(query, model, after))
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield '{"msg": "ok", "result": ['
+        separator = ''
+        for row in query:
+            yield separator + dumps(serialize(row))
+            separator = ','
+        yield ']}'
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
+
+
+EXPORT_FORMATS = {'application/x-ndjson': 'ndjson', 'text/csv': 'csv'}
+
+def export_format():
+    """?format=ndjson|csv, else negotiated from Accept (NDJSON when the client accepts anything)."""
+    requested = request.args.get('format')
+    if requested is not None:
+        if requested not in EXPORT_FORMATS.values():
+            raise APIException('Formato no válido: {}. Usa ndjson o csv'.format(requested), status_code=400)
+        return requested
+    if not request.accept_mimetypes:
+        return 'ndjson'
+    mimetype = request.accept_mimetypes.best_match(list(EXPORT_FORMATS))
+    if mimetype is None:
+        raise APIException('Solo se puede exportar como application/x-ndjson o text/csv', status_code=406)
+    return EXPORT_FORMATS[mimetype]
+
+def stream_export(model, name):
+    """Every column of every row of `model` in id order as NDJSON or CSV, resumable with ?after=<last id>.
+
+    Rows come from a single server-side cursor (stream_results) and go out in batches of
+    API_STREAM_BATCH_SIZE, so memory stays flat however large the table is.
+    """
+    after = request.args.get('after')
+    try:
+        after = int(after) if after is not None else None
+    except ValueError:
+        raise APIException('El parámetro after debe ser un entero', status_code=400)
+    format = export_format()
+    columns = list(model.__table__.columns)
+    names = [column.name for column in columns]
+    statement = select(*columns).order_by(model.id)
+    if after is not None:
+        statement = statement.where(model.id > after)
+    batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+    dumps = current_app.json.dumps
+
+    def generate():
+        result = db.session.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        if format == 'csv':
+            writer.writerow(names)
+        for rows in result.partitions():
+            if format == 'csv':
+                writer.writerows(rows)
+            else:
+                buffer.writelines(dumps(dict(zip(names, row)), sort_keys=False) + '\n' for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            # CSV header of an empty export
+            yield buffer.getvalue()
+
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    response = current_app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename={}.{}'.format(name, format)
+    return response
+
+def conditional(*tables):
+    """Strong ETag from the version counters of `tables`; answers If-None-Match with a 304 before running the view."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = table_versions(*tables)
+            matched = matching_etag(etag)
+            if matched is not None:
+                response = current_app.response_class(status=304)
+                response.set_etag(matched)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+class SparseFields:
+    """?fields=id,name for the resource and ?fields[<relation>]=... for embedded rows.
+
+    Reads select plain column tuples (relations through outer joins) and map them straight to the
+    output dicts, so no ORM instances are built. Only the requested columns are selected and
+    relationships that were not asked for are not joined. Without any fields parameter the output
+    is the same as serialize().
+    """
+    param = re.compile(r'^fields(?:\[(\w+)\])?$')
+
+    def __init__(self, model):
+        self.model = model
+        self.spec = {}
+        for key, value in request.args.items():
+            match = self.param.match(key)
+            if match:
+                self.spec[match.group(1)] = [name.strip() for name in value.split(',') if name.strip()]
+        self.active = bool(self.spec)
+        if self.active:
+            reachable = set()
+            self._validate(model, self.fields_for(None, model), reachable)
+            for relation in self.spec:
+                if relation is not None and relation not in reachable:
+                    raise APIException('Relación no válida: {}'.format(relation), status_code=400)
+        self._columns, self._joins = [], []
+        self._layout = self._project(model, model, self.fields_for(None, model), '')
+
+    def fields_for(self, relation, model):
+        requested = self.spec.get(relation)
+        if requested is None:
+            return list(model.public_fields) + list(getattr(model, 'relations', {}))
+        return requested
+
+    def key(self):
+        return tuple(sorted((relation or '', tuple(fields)) for relation, fields in self.spec.items()))
+
+    def query(self):
+        """Column-tuple query; the root id is labelled `id`, so paginate() and keyset() work unchanged."""
+        query = self.model.query.with_entities(*self._columns)
+        for join in self._joins:
+            query = query.outerjoin(join)
+        return query
+
+    def row(self, row):
+        if row is None:
+            return None
+        return self._build(row, self._layout)
+
+    def get(self, id):
+        return self.row(self.query().filter(self.model.id == id).first())
+
+    def _validate(self, model, fields, reachable):
+        relations = getattr(model, 'relations', {})
+        for name in fields:
+            if name not in model.public_fields and name not in relations:
+                raise APIException('Campo no válido: {}'.format(name), status_code=400)
+        for name, attribute in relations.items():
+            if name not in reachable:
+                reachable.add(name)
+                related = getattr(model, attribute).property.mapper.class_
+                self._validate(related, self.fields_for(name, related), reachable)
+
+    def _add_column(self, column, label):
+        self._columns.append(column.label(label))
+        return len(self._columns) - 1
+
+    def _project(self, model, entity, fields, prefix):
+        # layout: (position of the id, [(key, position)], [(key, nested layout)])
+        relations = getattr(model, 'relations', {})
+        id_position = self._add_column(entity.id, prefix + 'id')
+        columns, nested = [], []
+        for name in fields:
+            if name in relations:
+                related = getattr(model, relations[name]).property.mapper.class_
+                # the same table can be reached twice (favorite.planet, favorite.character.planet)
+                alias = aliased(related)
+                self._joins.append(getattr(entity, relations[name]).of_type(alias))
+                nested.append((name, self._project(related, alias, self.fields_for(name, related), prefix + name + '__')))
+            elif name == 'id':
+                columns.append((name, id_position))
+            else:
+                columns.append((name, self._add_column(getattr(entity, name), prefix + name)))
+        return id_position, columns, nested
+
+    def _build(self, row, layout):
+        _, columns, nested = layout
+        data = {name: row[position] for name, position in columns}
+        for name, related in nested:
+            # an outer join without a match leaves the related id NULL; serialize() skips those too
+            if row[related[0]] is not None:
+                data[name] = self._build(row, related)
+        return data
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    links = ['/admin/'] if app.config.get('ADMIN') != 'off' else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
@@ -38,4 +401,4 @@ def generate_sitemap(app):
         <p>API HOST: <script>document.write('<input style="padding: 5px; width: 300px" type="text" value="'+window.location.href+'" />');</script></p>
         <p>Start working on your proyect by following the <a href="https://start.4geeksacademy.com/starters/flask" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
-        <ul style="text-align: left;">"""+links_html+"</ul></div>"
+        <ul style="text-align: left;">""" + links_html + "</ul></div>"
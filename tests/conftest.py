@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC)
+
+# every test drops and recreates the tables, so never point this at a database you care about
+os.environ['DATABASE_URL'] = os.getenv('TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['ADMIN'] = 'off'
+# an N+1 in any route a test exercises raises QueryProblem instead of just logging it
+os.environ.setdefault('QUERY_DETECTOR', 'strict')
+# on a busy CI box a cold SQLite statement can take a while; only N+1s should fail the suite
+os.environ.setdefault('QUERY_DETECTOR_SLOW_MS', '1000')
+
+from app import app as flask_app  # noqa: E402
+from cache import entity_cache  # noqa: E402
+from models import db, User, Planet, Character, Vehicle, Favorite, FavoriteCount  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    # exceptions raised in the app, QueryProblem included, reach the test instead of becoming a 500
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        entity_cache.clear()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def seed(app):
+    """seed(n): n planets, characters and vehicles, one user and n favorites of every type for that user."""
+    def seed(n):
+        db.session.add(User(id=1, email='luke@example.com', password='x', is_active=True))
+        db.session.add_all(Planet(id=i, name='Planet {}'.format(i), population=i * 1000) for i in range(1, n + 1))
+        db.session.flush()
+        db.session.add_all(Character(id=i, name='Character {}'.format(i), height=100 + i, mass=50 + i, planet_id=i) for i in range(1, n + 1))
+        db.session.add_all(Vehicle(id=i, name='Vehicle {}'.format(i), type='speeder') for i in range(1, n + 1))
+        db.session.flush()
+        db.session.add_all(Favorite(user_id=1, planet_id=i) for i in range(1, n + 1))
+        db.session.add_all(Favorite(user_id=1, vehicles_id=i) for i in range(1, n + 1))
+        db.session.add_all(Favorite(user_id=1, characters_id=i) for i in range(1, n + 1))
+        db.session.flush()
+        FavoriteCount.rebuild()
+        db.session.commit()
+        entity_cache.clear()
+    return seed
+
+
+@pytest.fixture
+def count_queries(app):
+    """`with count_queries() as count:` counts the statements sent to the database in the block into count[0]."""
+    @contextmanager
+    def count_queries():
+        count = [0]
+
+        def before_cursor_execute(*args):
+            count[0] += 1
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield count
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return count_queries
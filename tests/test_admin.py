@@ -0,0 +1,87 @@
+import pytest
+from werkzeug.test import Client
+
+pytest.importorskip('flask_admin')
+from admin import LazyAdmin  # noqa: E402
+from database import init_engine  # noqa: E402
+from models import db, Planet, Favorite, FavoriteCount  # noqa: E402
+
+
+@pytest.fixture
+def lazy(app):
+    return LazyAdmin(app, init_engine)
+
+
+@pytest.fixture
+def admin(lazy):
+    client = Client(lazy)
+
+    def request(method, path, **kwargs):
+        response = client.open(path, method=method, **kwargs)
+        # the test's session must not keep reading the snapshot from before the admin's commit
+        db.session.rollback()
+        return response
+    return request
+
+
+def search(client, q):
+    return [(result['type'], result['id']) for result in client.get('/search?q=' + q).get_json()['result']]
+
+
+def test_admin_is_built_on_its_first_request(app, lazy):
+    client = Client(lazy)
+    assert client.get('/planets').status_code == 200
+    assert lazy.admin_app is None
+    # a path that only starts with "admin" is still the API's
+    assert client.get('/administrator').status_code == 404
+    assert lazy.admin_app is None
+
+    response = client.get('/admin/')
+    assert response.status_code == 200 and '4Geeks Admin' in response.get_data(as_text=True)
+    admin_app = lazy.admin_app
+    assert admin_app is not None and admin_app is not app
+    assert client.get('/admin').status_code in (200, 301, 308)
+    assert client.get('/admin/planet/').status_code == 200
+    assert lazy.admin_app is admin_app
+    # the API app never gets the admin routes
+    assert not any(rule.rule.startswith('/admin') for rule in app.url_map.iter_rules())
+
+
+def test_catalog_edits_update_the_search_index(client, admin):
+    assert admin('POST', '/admin/planet/new/', data={'name': 'Tatooine', 'population': '200000'}).status_code == 302
+    [planet_id] = [id for (id,) in db.session.query(Planet.id)]
+    assert search(client, 'tato') == [('planet', planet_id)]
+
+    assert admin('POST', '/admin/planet/edit/?id={}'.format(planet_id), data={'name': 'Naboo', 'population': '1'}).status_code == 302
+    assert search(client, 'tato') == []
+    assert search(client, 'nab') == [('planet', planet_id)]
+
+    assert admin('POST', '/admin/planet/delete/', data={'id': planet_id}).status_code == 302
+    assert search(client, 'nab') == []
+
+
+def test_favorite_edits_move_the_counters(client, seed, admin):
+    seed(3)
+    db.session.query(Favorite).delete()
+    FavoriteCount.rebuild()
+    db.session.commit()
+
+    assert admin('POST', '/admin/favorite/new/', data={'user': '1', 'planet': '2'}).status_code == 302
+    favorite_id = db.session.query(Favorite.id).scalar()
+    assert db.session.get(FavoriteCount, ('planet', 2)).count == 1
+
+    assert admin('POST', '/admin/favorite/edit/?id={}'.format(favorite_id), data={'user': '1', 'planet': '3'}).status_code == 302
+    assert db.session.get(FavoriteCount, ('planet', 2)).count == 0
+    assert db.session.get(FavoriteCount, ('planet', 3)).count == 1
+    assert [entry['item']['id'] for entry in client.get('/favorites/top?type=planet').get_json()['result']] == [3]
+
+    assert admin('POST', '/admin/favorite/delete/', data={'id': favorite_id}).status_code == 302
+    assert db.session.get(FavoriteCount, ('planet', 3)).count == 0
+    assert client.get('/favorites/top?type=planet').get_json()['result'] == []
+
+
+def test_deleting_an_item_forgets_its_counter(seed, admin):
+    seed(2)
+    assert db.session.get(FavoriteCount, ('vehicle', 1)).count == 1
+    assert admin('POST', '/admin/vehicle/delete/', data={'id': 1}).status_code == 302
+    assert db.session.get(FavoriteCount, ('vehicle', 1)) is None
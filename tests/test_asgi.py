@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import asgi
+
+@pytest.fixture
+def get(app):
+    """get(path) -> (status, body) from the ASGI read server, on the test database through its async driver."""
+    url = os.environ['DATABASE_URL']
+    # sqlite+aiosqlite://... -> aiosqlite
+    pytest.importorskip(asgi.async_url(url).split('://')[0].partition('+')[2])
+    api = asgi.ReadAPI(url)
+
+    async def request(path):
+        path, _, query_string = path.partition('?')
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+        await api({'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string.encode()}, None, send)
+        return messages[0]['status'], json.loads(messages[1]['body'])
+
+    def get(path):
+        return asyncio.run(request(path))
+    yield get
+    if api.engine is not None:
+        asyncio.run(api.engine.dispose())
+
+
+@pytest.mark.parametrize('path', [
+    '/planets?sort=-population',
+    '/planets?name_prefix=Pla',
+    '/characters?mass_min=10',
+    '/vehicles?fields=name',
+    '/favorites/all?stream=1',
+    '/planets/1?fields=name',
+    '/favorites/user/1?fields[planet]=name',
+])
+def test_parameters_only_the_flask_app_serves_are_rejected(get, seed, path):
+    seed(3)
+    status, body = get(path)
+    assert status == 400
+    assert 'no soportados' in body['message']
+
+
+@pytest.mark.parametrize('path', [
+    '/planets',
+    '/planets?limit=2&after=2',
+    '/planets/3',
+    '/planets/99',
+    '/characters?limit=4',
+    '/characters/2',
+    '/vehicles?limit=3&after=1',
+    '/vehicles/99',
+    '/favorites/all?limit=5&after=3',
+    '/favorites/user/1',
+    '/favorites/user/99',
+    '/planets?limit=x',
+    '/planets?limit=0',
+])
+def test_same_responses_as_the_flask_app(client, get, seed, path):
+    seed(5)
+    # favorites added out of id order, so only an explicit ORDER BY id returns them like the Flask app
+    client.delete('/favorites/user/1/remove', json={'favorite_id': 1})
+    client.post('/favorites/user/1/add', json={'type': 'planet', 'item_id': 1})
+    flask = client.get(path)
+    assert get(path) == (flask.status_code, flask.get_json())
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('postgres://u:p@db/app', 'postgresql+asyncpg://u:p@db/app'),
+    ('postgresql+psycopg2://u:p@db/app', 'postgresql+asyncpg://u:p@db/app'),
+    ('mysql+pymysql://u:p@db/app?charset=utf8mb4', 'mysql+aiomysql://u:p@db/app?charset=utf8mb4'),
+    ('mysql+mysqlconnector://u:p@db/app', 'mysql+aiomysql://u:p@db/app'),
+    ('sqlite:////tmp/app.db', 'sqlite+aiosqlite:////tmp/app.db'),
+    ('sqlite+aiosqlite:////tmp/app.db', 'sqlite+aiosqlite:////tmp/app.db'),
+    ('oracle://u:p@db/app', 'oracle://u:p@db/app'),
+])
+def test_async_url_replaces_any_sync_driver(url, expected):
+    assert asgi.async_url(url) == expected
+
+
+def test_query_string_is_utf8(get, seed):
+    seed(3)
+    status, body = get('/planets?fields[señal]=name')
+    assert status == 400
+    assert 'fields[señal]' in body['message']
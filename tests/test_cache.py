@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+from cache import FileBackend, SharedCache, entity_cache
+
+
+def test_shared_cache_needs_ttl(tmp_path):
+    with pytest.raises(ValueError):
+        SharedCache(FileBackend(str(tmp_path)), ttl=None)
+
+
+def test_file_backend_drops_expired_entries(tmp_path):
+    backend = FileBackend(str(tmp_path), sweep_every=3)
+    backend.set('old', '1', ttl=-1)
+    backend.set('read', '2', ttl=-1)
+    assert backend.get('read') is None
+    assert not os.path.exists(backend._path('read'))
+    backend.set('new', '3', ttl=60)
+    # the third set swept 'old', which was never read again
+    assert not os.path.exists(backend._path('old'))
+    assert backend.get('new') == '3'
+
+
+def test_page_key_ignores_unrelated_parameters(client, seed):
+    seed(3)
+    assert client.get('/planets?limit=2&utm_source=a').status_code == 200
+    hits = entity_cache.stats()['hits']
+    assert client.get('/planets?utm_source=b&limit=2').status_code == 200
+    assert entity_cache.stats()['hits'] == hits + 1
+
+
+def test_shared_cache_does_not_grow_with_repeated_reads(tmp_path):
+    cache = SharedCache(FileBackend(str(tmp_path)), ttl=60)
+    for _ in range(50):
+        cache.set(('planets.1', 'page'), {'result': [1]}, depends_on=[('planets', '*')])
+        assert cache.get(('planets.1', 'page')) == {'result': [1]}
+    # one entry, rewritten in place; no per-read bookkeeping next to it
+    [name] = os.listdir(str(tmp_path))
+    assert os.path.getsize(os.path.join(str(tmp_path), name)) < 100
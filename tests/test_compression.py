@@ -0,0 +1,64 @@
+import gzip
+
+import pytest
+
+from compression import compression, brotli
+from models import db
+import search
+
+
+@pytest.fixture
+def planets(client, seed):
+    seed(30)
+    compression.cache.clear()
+    return client
+
+
+def test_gzip_is_negotiated_and_decodes_to_the_plain_body(planets):
+    plain = planets.get('/planets')
+    compressed = planets.get('/planets', headers={'Accept-Encoding': 'gzip'})
+    assert plain.headers.get('Content-Encoding') is None
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert gzip.decompress(compressed.data) == plain.data
+
+
+@pytest.mark.skipif(brotli is None, reason='brotli is not installed')
+@pytest.mark.parametrize('accept, encoding', [('gzip, br', 'br'), ('br;q=0.5, gzip', 'gzip'), ('identity', None)])
+def test_brotli_is_preferred_unless_the_client_ranks_it_lower(planets, accept, encoding):
+    response = planets.get('/planets', headers={'Accept-Encoding': accept})
+    assert response.headers.get('Content-Encoding') == encoding
+
+
+def test_compressed_etag_revalidates_with_304(planets):
+    plain = planets.get('/planets')
+    compressed = planets.get('/planets', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    for headers in ({'Accept-Encoding': 'gzip'}, {}):
+        response = planets.get('/planets', headers=dict(headers, **{'If-None-Match': compressed.headers['ETag']}))
+        assert response.status_code == 304
+        assert response.headers['ETag'] == compressed.headers['ETag']
+    # a write moves the version, so the old variant no longer matches
+    planets.put('/planet/1', json={'population': 1})
+    assert planets.get('/planets', headers={'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['ETag']}).status_code == 200
+
+
+def test_small_bodies_pass_through(planets):
+    response = planets.get('/planets/1', headers={'Accept-Encoding': 'gzip'})
+    assert len(response.data) < compression.min_size
+    assert response.headers.get('Content-Encoding') is None
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_only_versioned_responses_are_cached(planets):
+    planets.get('/planets?limit=20', headers={'Accept-Encoding': 'gzip'})
+    planets.get('/planets?limit=20', headers={'Accept-Encoding': 'gzip'})
+    assert compression.cache.stats()['size'] == 1
+    assert compression.cache.stats()['hits'] == 1
+    # no ETag: compressed on every request and never stored
+    search.rebuild()
+    db.session.commit()
+    response = planets.get('/search?q=planet&limit=30', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip' and 'ETag' not in response.headers
+    assert compression.cache.stats()['size'] == 1
+    assert compression.cache.stats()['bytes'] <= compression.cache.maxbytes
@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import asgi
+from database import engine_options, get_pool_stats, sqlite_pragmas
+from models import db
+
+sqlite_only = pytest.mark.skipif(not os.environ['DATABASE_URL'].startswith('sqlite'), reason='SQLite PRAGMAs')
+
+
+@pytest.fixture
+def pool_env(monkeypatch):
+    for name, value in [('DB_POOL_SIZE', '2'), ('DB_MAX_OVERFLOW', '1'), ('DB_POOL_TIMEOUT', '0.1'),
+                        ('DB_POOL_RECYCLE', '60'), ('DB_POOL_PRE_PING', 'false')]:
+        monkeypatch.setenv(name, value)
+
+
+def test_pool_is_sized_from_the_environment(pool_env, tmp_path):
+    options = engine_options('postgresql://app@db/app')
+    assert {name: value for name, value in options.items() if name != 'poolclass'} == {
+        'pool_size': 2, 'max_overflow': 1, 'pool_timeout': 0.1, 'pool_recycle': 60, 'pool_pre_ping': False,
+    }
+    assert engine_options('sqlite:///app.db') == {}
+
+    # any file database takes a queue pool, so the sizing can be exercised without a server
+    engine = create_engine('sqlite:///' + str(tmp_path / 'pool.db'), **options)
+    connections = [engine.connect() for _ in range(3)]
+    stats = get_pool_stats(engine)
+    assert (stats['pool'], stats['size'], stats['overflow'], stats['timeout']) == ('TimedQueuePool', 2, 1, 0.1)
+    # pool_size + max_overflow connections, then checkouts wait pool_timeout and fail
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    assert get_pool_stats(engine)['wait_seconds_max'] >= 0.1
+    for connection in connections:
+        connection.close()
+    engine.dispose()
+
+
+def test_async_pool_keeps_the_sizing(pool_env, tmp_path):
+    pytest.importorskip('aiosqlite')
+    options = asgi.async_engine_options('postgresql://app@db/app')
+    assert 'poolclass' not in options
+    # aiosqlite defaults to NullPool; asyncpg and aiomysql get this queue pool on their own
+    engine = create_async_engine('sqlite+aiosqlite:///' + str(tmp_path / 'pool.db'), poolclass=AsyncAdaptedQueuePool, **options)
+    pool = engine.sync_engine.pool
+    assert (type(pool).__name__, pool.size(), pool.timeout()) == ('AsyncAdaptedQueuePool', 2, 0.1)
+
+
+@sqlite_only
+def test_app_engine_runs_the_pragmas(app):
+    with db.engine.connect() as connection:
+        values = [connection.exec_driver_sql('PRAGMA ' + name).scalar() for name in ('journal_mode', 'synchronous', 'cache_size')]
+    # NORMAL is 1
+    assert values == ['wal', 1, -20000]
+
+
+@sqlite_only
+def test_async_engine_runs_the_same_pragmas(app, monkeypatch):
+    pytest.importorskip('aiosqlite')
+    # both differ from what sqlite3 and aiosqlite set on their own
+    monkeypatch.setenv('SQLITE_BUSY_TIMEOUT', '1234')
+    monkeypatch.setenv('SQLITE_CACHE_SIZE', '-4321')
+    api = asgi.ReadAPI(os.environ['DATABASE_URL'])
+
+    async def pragmas():
+        api.start()
+        try:
+            async with api.engine.connect() as connection:
+                return [(await connection.exec_driver_sql('PRAGMA ' + name)).scalar() for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size')]
+        finally:
+            await api.engine.dispose()
+    assert asyncio.run(pragmas()) == ['wal', 1, 1234, -4321]
+
+
+def test_pragma_values_are_checked(monkeypatch):
+    monkeypatch.setenv('SQLITE_JOURNAL_MODE', 'WAL; DROP TABLE planets')
+    with pytest.raises(ValueError):
+        sqlite_pragmas()
@@ -0,0 +1,76 @@
+import csv
+import io
+import json
+
+import pytest
+
+from models import db, Planet
+
+
+@pytest.fixture
+def small_batches(app):
+    batch_size = app.config['API_STREAM_BATCH_SIZE']
+    app.config['API_STREAM_BATCH_SIZE'] = 4
+    yield
+    app.config['API_STREAM_BATCH_SIZE'] = batch_size
+
+
+def test_ndjson_has_every_column_of_every_row(client, seed, small_batches):
+    seed(10)
+    db.session.add(Planet(id=11, name='Naboo, "the green"', population=None))
+    db.session.commit()
+    response = client.get('/export/planets')
+    assert response.status_code == 200 and response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=planets.ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    expected = [{'id': i, 'name': 'Planet {}'.format(i), 'population': i * 1000} for i in range(1, 11)]
+    expected.append({'id': 11, 'name': 'Naboo, "the green"', 'population': None})
+    assert [json.loads(line) for line in lines] == expected
+
+
+def test_csv_quotes_and_resumes(client, seed, small_batches):
+    seed(10)
+    db.session.add(Planet(id=11, name='Naboo, "the green"', population=None))
+    db.session.commit()
+    response = client.get('/export/planets?format=csv&after=8')
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=planets.csv'
+    assert list(csv.reader(io.StringIO(response.get_data(as_text=True)))) == [
+        ['id', 'name', 'population'],
+        ['9', 'Planet 9', '9000'],
+        ['10', 'Planet 10', '10000'],
+        ['11', 'Naboo, "the green"', ''],
+    ]
+
+
+def test_empty_exports(client):
+    assert client.get('/export/vehicles').get_data() == b''
+    assert client.get('/export/vehicles?format=csv').get_data(as_text=True) == 'id,name,type\n'
+
+
+def test_foreign_keys_are_exported_as_columns(client, seed):
+    seed(2)
+    rows = [json.loads(line) for line in client.get('/export/favorites').get_data(as_text=True).splitlines()]
+    assert rows[0] == {'id': 1, 'user_id': 1, 'planet_id': 1, 'vehicles_id': None, 'characters_id': None}
+    assert len(rows) == 6
+
+
+@pytest.mark.parametrize('accept, mimetype', [
+    ('text/csv', 'text/csv'),
+    ('application/x-ndjson', 'application/x-ndjson'),
+    ('text/csv;q=0.5, application/x-ndjson', 'application/x-ndjson'),
+    ('*/*', 'application/x-ndjson'),
+])
+def test_format_from_accept(client, accept, mimetype):
+    assert client.get('/export/planets', headers={'Accept': accept}).mimetype == mimetype
+
+
+@pytest.mark.parametrize('path, headers, status', [
+    ('/export/planets?format=xml', {}, 400),
+    ('/export/planets', {'Accept': 'application/xml'}, 406),
+    ('/export/planets?after=x', {}, 400),
+    ('/export/user', {}, 404),
+])
+def test_bad_export_requests(client, path, headers, status):
+    assert client.get(path, headers=headers).status_code == status
@@ -0,0 +1,48 @@
+from models import db, User
+
+
+def test_batch_rejects_booleans(client, seed):
+    seed(1)
+    response = client.post('/favorites/user/1/batch', json={'add': [{'type': 'planet', 'item_id': True}], 'remove': [True]})
+    assert response.status_code == 400
+    assert len(response.get_json()['errors']) == 2
+    assert len(client.get('/favorites/user/1').get_json()['result']) == 3
+
+
+def test_add_favorite_tells_missing_items_from_duplicates(client, seed):
+    seed(1)
+    assert client.post('/favorites/user/1/add', json={'type': 'planet', 'item_id': 99}).status_code == 404
+    assert client.post('/favorites/user/1/add', json={'type': 'planet', 'item_id': 1}).status_code == 409
+    client.post('/planets', json={'name': 'Hoth'})
+    assert client.post('/favorites/user/1/add', json={'type': 'planet', 'item_id': 2}).status_code == 201
+
+
+def test_top_favorites_merges_every_type(client, seed):
+    seed(3)
+    result = client.get('/favorites/top?limit=4').get_json()['result']
+    assert len(result) == 4
+    assert {entry['type'] for entry in result} <= {'planet', 'vehicle', 'character'}
+    assert all(entry['count'] == 1 for entry in result)
+
+
+def test_top_favorites_after_deleting_a_planet(client, seed):
+    seed(3)
+    assert client.delete('/planet/2').status_code == 200
+    result = client.get('/favorites/top?type=character').get_json()['result']
+    characters = {entry['item']['id']: entry['item'] for entry in result}
+    assert set(characters) == {1, 2, 3}
+    assert 'planet' not in characters[2]
+    assert characters[1]['planet']['id'] == 1
+
+
+def test_batch_with_a_character_without_planet(client, seed):
+    seed(3)
+    client.delete('/planet/2')
+    db.session.add(User(id=2, email='leia@example.com', password='x', is_active=True))
+    db.session.commit()
+    response = client.post('/favorites/user/2/batch', json={'add': [{'type': 'character', 'item_id': 2}, {'type': 'planet', 'item_id': 1}], 'remove': []})
+    assert response.status_code == 200
+    [character, planet] = [entry['favorite'] for entry in response.get_json()['result']]
+    assert 'planet' not in character['character'] and planet['planet']['id'] == 1
+    # replaying the batch is a no-op, not a conflict
+    assert client.post('/favorites/user/2/batch', json={'add': [{'type': 'character', 'item_id': 2}], 'remove': []}).status_code == 200
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from models import db, User, Planet, Character, Favorite, CHARACTER_LOAD, FAVORITE_LOAD
+
+
+@contextmanager
+def statements():
+    sent = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        sent.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield sent
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_without_fields_rows_match_serialize(client, seed):
+    seed(4)
+    assert client.get('/planets').get_json()['result'] == [planet.serialize() for planet in Planet.query.order_by(Planet.id)]
+    characters = Character.query.options(*CHARACTER_LOAD).order_by(Character.id)
+    assert client.get('/characters').get_json()['result'] == [character.serialize() for character in characters]
+    favorites = Favorite.query.options(*FAVORITE_LOAD).order_by(Favorite.id)
+    assert client.get('/favorites/all').get_json()['result'] == [{'favorite': favorite.serialize()} for favorite in favorites]
+
+
+def test_only_the_requested_columns_are_selected(client, seed):
+    seed(3)
+    with statements() as sent:
+        result = client.get('/planets?fields=name').get_json()['result']
+    assert result == [{'name': 'Planet 1'}, {'name': 'Planet 2'}, {'name': 'Planet 3'}]
+    [select] = [statement for statement in sent if 'FROM planets' in statement]
+    assert 'population' not in select
+
+    with statements() as sent:
+        assert client.get('/characters/2?fields=name,mass').get_json()['result'] == {'name': 'Character 2', 'mass': 52}
+    # no planet requested, no join
+    assert not any('JOIN' in statement for statement in sent)
+
+
+def test_nested_fields_use_one_alias_per_path(client, seed):
+    seed(3)
+    # favorite.planet and favorite.character.planet are both planets, but not the same one
+    db.session.add(User(id=2, email='leia@example.com', password='x', is_active=True))
+    db.session.add(Favorite(id=100, user_id=2, planet_id=2, characters_id=3))
+    db.session.commit()
+    with statements() as sent:
+        response = client.get('/favorites/all?fields=id,planet,character&fields[planet]=name&fields[character]=name,planet&after=99')
+    [favorite] = response.get_json()['result']
+    assert favorite == {'favorite': {
+        'id': 100,
+        'planet': {'name': 'Planet 2'},
+        'character': {'name': 'Character 3', 'planet': {'name': 'Planet 3'}},
+    }}
+    assert len([statement for statement in sent if 'FROM favorite' in statement]) == 1
+
+
+def test_relations_without_a_match_are_left_out(client, seed):
+    seed(2)
+    [favorite] = client.get('/favorites/all?fields=id,vehicle&limit=1').get_json()['result']
+    # the first favorite is a planet
+    assert favorite == {'favorite': {'id': 1}}
+
+
+@pytest.mark.parametrize('query, message', [
+    ('fields=name,secret', 'Campo no válido: secret'),
+    ('fields[moon]=name', 'Relación no válida: moon'),
+    ('fields[planet]=name,orbit', 'Campo no válido: orbit'),
+])
+def test_unknown_fields_are_rejected(client, query, message):
+    response = client.get('/characters?' + query)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == message
@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import select, text, tuple_
+
+from models import db, Favorite, Character, Planet, Vehicle
+from utils import prefix_range
+
+# hot lookups -> indexes that must serve them
+QUERIES = {
+    'favorites_of_user': (select(Favorite).where(Favorite.user_id == 1), ('uq_favorite_user_planet', 'uq_favorite_user_vehicle', 'uq_favorite_user_character', 'ix_favorite_user_id_id')),
+    'favorite_exists': (select(Favorite.id).where(Favorite.user_id == 1, Favorite.planet_id == 1), ('uq_favorite_user_planet',)),
+    'favorites_of_planet': (select(Favorite).where(Favorite.planet_id == 1), ('ix_favorite_planet_id',)),
+    'favorites_of_vehicle': (select(Favorite).where(Favorite.vehicles_id == 1), ('ix_favorite_vehicles_id',)),
+    'favorites_of_character': (select(Favorite).where(Favorite.characters_id == 1), ('ix_favorite_characters_id',)),
+    'characters_of_planet': (select(Character).where(Character.planet_id == 1), ('ix_characters_planet_id',)),
+    # keyset pages sorted by a column, see utils.keyset()
+    'planets_by_population': (
+        select(Planet).where(Planet.population.isnot(None), tuple_(Planet.population, Planet.id) > tuple_(5000, 5))
+        .order_by(Planet.population, Planet.id).limit(11),
+        ('ix_planets_population_id',),
+    ),
+    'characters_by_mass_desc': (
+        select(Character).where(Character.mass.isnot(None), tuple_(Character.mass, Character.id) < tuple_(60, 10))
+        .order_by(Character.mass.desc(), Character.id.desc()).limit(11),
+        ('ix_characters_mass_id',),
+    ),
+    'favorites_by_user': (
+        select(Favorite).where(tuple_(Favorite.user_id, Favorite.id) > tuple_(1, 5)).order_by(Favorite.user_id, Favorite.id).limit(11),
+        ('ix_favorite_user_id_id',),
+    ),
+    'vehicles_type_prefix': (select(Vehicle).where(*prefix_range(Vehicle.type, 'spe')), ('ix_vehicles_type_id',)),
+}
+
+
+def plan(statement):
+    sql = str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return '\n'.join(row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)))
+    if dialect == 'postgresql':
+        # the test tables are tiny, so only a disabled sequential scan shows what the index can do
+        db.session.execute(text('SET LOCAL enable_seqscan = off'))
+        return '\n'.join(row[0] for row in db.session.execute(text('EXPLAIN ' + sql)))
+    pytest.skip('EXPLAIN checks cover SQLite and Postgres')
+
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_hot_queries_use_indexes(app, seed, name):
+    statement, indexes = QUERIES[name]
+    seed(20)
+    found = plan(statement)
+    assert any(index in found for index in indexes), found
+
+
+def test_duplicate_favorites_are_rejected(app, seed):
+    seed(1)
+    db.session.add(Favorite(user_id=1, planet_id=1))
+    with pytest.raises(Exception) as error:
+        db.session.commit()
+    assert 'unique' in str(error.value).lower()
+    db.session.rollback()
@@ -0,0 +1,70 @@
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from uuid import UUID
+
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+pytest.importorskip('orjson')
+from json_provider import ORJSONProvider  # noqa: E402
+
+PATHS = [
+    '/planets',
+    '/characters?fields=name,planet',
+    '/favorites/all',
+    '/favorites/user/1',
+    '/favorites/top',
+    '/planets?stream=1',
+    '/stats/characters',
+    '/planets/99',
+]
+
+
+def decoded(body):
+    # pairs keep the key order, so two bodies only compare equal if their keys come out in the same order
+    return json.loads(body, object_pairs_hook=list)
+
+
+@pytest.fixture
+def providers(app):
+    original = app.json
+
+    def use(provider_class):
+        app.json = provider_class(app)
+    yield use
+    app.json = original
+
+
+def test_same_text_as_the_default_provider_for_awkward_values(app):
+    value = {
+        'when': datetime(2024, 5, 4, 13, 30, tzinfo=timezone.utc),
+        'day': date(2024, 5, 4),
+        'price': Decimal('9.99'),
+        'uuid': UUID('12345678-1234-5678-1234-567812345678'),
+        'name': 'Señor Ñu',
+        'b': [1, 2.5, None, True],
+        'a': {'z': 1, 'y': 2},
+    }
+    default, fast = DefaultJSONProvider(app).dumps(value), ORJSONProvider(app).dumps(value)
+    assert decoded(fast) == decoded(default)
+    # datetimes are HTTP dates with either provider, not ISO 8601
+    assert json.loads(fast)['when'] == 'Sat, 04 May 2024 13:30:00 GMT'
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_responses_match_the_default_provider(client, seed, providers, path):
+    seed(4)
+    providers(DefaultJSONProvider)
+    expected = client.get(path)
+    providers(ORJSONProvider)
+    response = client.get(path)
+    assert response.status_code == expected.status_code
+    assert decoded(response.get_data()) == decoded(expected.get_data())
+
+
+def test_request_bodies_are_parsed_with_orjson(client, providers):
+    providers(ORJSONProvider)
+    response = client.post('/planets', data='{"name": "Alderaan \\u00f1", "population": 2000000000}', content_type='application/json')
+    assert response.status_code == 200
+    assert response.get_json()['planet']['name'] == 'Alderaan ñ'
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from metrics import Metrics
+
+REQUESTS = ('http_requests_total', (('endpoint', 'list_planets'), ('method', 'GET'), ('status', '200')))
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_snapshot(directory, pid, count):
+    path = os.path.join(str(directory), 'metrics-{}-1.json'.format(pid))
+    with open(path, 'w') as f:
+        json.dump([[REQUESTS[0], [list(pair) for pair in REQUESTS[1]], count]], f)
+    return path
+
+
+def test_snapshots_of_exited_workers_are_folded_once(tmp_path):
+    metrics = Metrics(directory=str(tmp_path))
+    first = write_snapshot(tmp_path, exited_pid(), 3)
+    second = write_snapshot(tmp_path, exited_pid(), 4)
+    running = write_snapshot(tmp_path, os.getppid(), 5)
+
+    assert metrics.collect()[REQUESTS] == 12
+    assert not os.path.exists(first) and not os.path.exists(second)
+    assert os.path.exists(running)
+    assert sorted(os.listdir(str(tmp_path))) == ['.lock', 'aggregate.json', os.path.basename(running)]
+    # folding again doesn't count them twice
+    assert metrics.collect()[REQUESTS] == 12
+
+
+def test_background_flush_without_requests(tmp_path):
+    metrics = Metrics(directory=str(tmp_path), flush_interval=0.05)
+    metrics.start_flusher()
+    metrics.inc(REQUESTS[0], dict(REQUESTS[1]))
+    deadline = time.monotonic() + 5
+    while not os.listdir(str(tmp_path)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    [name] = os.listdir(str(tmp_path))
+    assert name.startswith('metrics-{}-'.format(os.getpid()))
+    # a worker that never served a request sees the count
+    assert Metrics(directory=str(tmp_path)).collect()[REQUESTS] == 1
@@ -0,0 +1,45 @@
+import pytest
+
+from models import db, Planet, Vehicle
+
+POPULATIONS = [300, None, 100, 300, None, 200, 100, 300, None, 200]
+
+
+@pytest.fixture
+def planets(app):
+    db.session.add_all(Planet(id=i, name='Planet {}'.format(i), population=population) for i, population in enumerate(POPULATIONS, 1))
+    db.session.commit()
+
+
+def walk(client, query, limit=3):
+    ids, after = [], None
+    while True:
+        page = client.get('/planets?{}&limit={}{}'.format(query, limit, '&after={}'.format(after) if after else '')).get_json()
+        ids.extend(planet['id'] for planet in page['result'])
+        after = page['next']
+        if after is None:
+            return ids
+
+
+def expected(descending):
+    rows = [(population, i) for i, population in enumerate(POPULATIONS, 1)]
+    values = sorted((row for row in rows if row[0] is not None), reverse=descending)
+    nulls = sorted((row for row in rows if row[0] is None), reverse=descending)
+    return [i for _, i in values + nulls]
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_follow_sort_with_ties_and_nulls_last(client, planets, descending):
+    sort = '-population' if descending else 'population'
+    assert walk(client, 'sort=' + sort) == expected(descending)
+    # one page big enough to span both parts, and the streamed body, give the same order
+    assert [planet['id'] for planet in client.get('/planets?sort={}&limit=100'.format(sort)).get_json()['result']] == expected(descending)
+    assert [planet['id'] for planet in client.get('/planets?sort={}&stream=1'.format(sort)).get_json()['result']] == expected(descending)
+
+
+def test_prefix_filter_is_a_range(client, app):
+    db.session.add_all(Vehicle(id=i, name='Vehicle {}'.format(i), type=type) for i, type in enumerate(['speeder', 'spe%der', 'starship', 'sp', 'Speeder', None], 1))
+    db.session.commit()
+    assert [vehicle['id'] for vehicle in client.get('/vehicles?type_prefix=spe').get_json()['result']] == [1, 2]
+    assert [vehicle['id'] for vehicle in client.get('/vehicles?type_prefix=spe%25').get_json()['result']] == [2]
+    assert [vehicle['id'] for vehicle in client.get('/vehicles?type_prefix=').get_json()['result']] == [1, 2, 3, 4, 5]
@@ -0,0 +1,39 @@
+import pytest
+
+from models import db, User, FavoriteCount
+
+
+@pytest.mark.parametrize('path', ['/characters', '/favorites/all', '/favorites/user/1'])
+def test_query_count_does_not_grow_with_rows(client, seed, count_queries, path):
+    counts = {}
+    for rows in (5, 50):
+        db.drop_all()
+        db.create_all()
+        seed(rows)
+        with count_queries() as count:
+            response = client.get(path)
+        assert response.status_code == 200
+        assert len(response.get_json()['result']) >= rows
+        counts[rows] = count[0]
+    assert counts[5] == counts[50], counts
+
+
+def test_batch_favorites_query_count_does_not_grow_with_items(client, seed, count_queries):
+    counts = {}
+    for rows in (5, 50):
+        db.drop_all()
+        db.create_all()
+        seed(rows)
+        db.session.add(User(id=2, email='leia@example.com', password='x', is_active=True))
+        # half the items have no counter row yet, so the upsert both inserts and updates
+        FavoriteCount.query.filter(FavoriteCount.item_id > rows // 2).delete()
+        db.session.commit()
+        add = [{'type': type, 'item_id': i} for type in ('planet', 'character') for i in range(1, rows + 1)]
+        with count_queries() as count:
+            response = client.post('/favorites/user/2/batch', json={'add': add, 'remove': []})
+        assert response.status_code == 200
+        counts[rows] = count[0]
+        assert dict(db.session.query(FavoriteCount.item_id, FavoriteCount.count).filter_by(type='planet')) == {
+            i: 2 if i <= rows // 2 else 1 for i in range(1, rows + 1)
+        }
+    assert counts[5] == counts[50], counts
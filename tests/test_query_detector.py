@@ -0,0 +1,53 @@
+import pytest
+from flask import g
+
+from models import db, Character
+from query_detector import QueryDetector, query_detector
+
+LIST_ROUTES = (
+    '/user',
+    '/planets',
+    '/planets?limit=5&sort=-population',
+    '/characters',
+    '/characters?planet_id=3&fields=name,planet',
+    '/vehicles',
+    '/vehicles?type=speeder',
+    '/stats/planets',
+    '/stats/characters',
+    '/search?q=planet',
+    '/favorites/user/1',
+    '/favorites/all',
+    '/favorites/top',
+)
+
+
+def test_tests_run_in_strict_mode():
+    assert query_detector.mode == 'strict'
+
+
+@pytest.mark.parametrize('path', LIST_ROUTES)
+def test_list_routes_have_no_n_plus_one(client, seed, path):
+    seed(20)
+    # QueryProblem propagates out of the client if the route repeats a statement per row
+    assert client.get(path).status_code == 200
+
+
+def test_strict_mode_reports_repeated_lazy_loads_only():
+    detector = QueryDetector(mode='strict', n1_threshold=3)
+    lazy = [('SELECT planets.name FROM planets WHERE planets.id = ?', 0.001, 'app.py:1 in serialize', True)] * 3
+    [finding] = detector.findings(lazy)
+    assert finding.startswith('N+1: 3 ejecuciones')
+    # the same statement sent by the code itself, e.g. query_in_chunks() batches
+    assert detector.findings([query[:3] + (False,) for query in lazy]) == []
+
+
+def test_lazy_loads_are_marked(app, seed):
+    seed(5)
+    db.session.expunge_all()
+    with app.test_request_context():
+        query_detector._before_request()
+        for character in Character.query.all():
+            character.planet
+        lazy = [statement for statement, _, _, lazy in g.query_log if lazy]
+        assert len(lazy) == 5 and all('FROM planets' in statement for statement in lazy)
+        assert any(not lazy for _, _, _, lazy in g.query_log)
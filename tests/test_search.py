@@ -0,0 +1,24 @@
+import search
+from models import db, Planet
+
+
+def test_create_all_builds_the_search_index(client):
+    # the app fixture only runs drop_all() and create_all(), no migrations
+    assert client.post('/planets', json={'name': 'Tatooine'}).status_code == 200
+    [result] = client.get('/search?q=tato').get_json()['result']
+    assert result['type'] == 'planet' and result['name'] == 'Tatooine'
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    assert client.get('/search?q=tato').get_json()['result'] == []
+
+
+def test_exact_name_wins_over_a_common_prefix(client):
+    # more matches than the old 1000-row candidate cutoff, with the exact name indexed last
+    db.session.add_all(Planet(id=i, name='Tatooine Outpost {}'.format(i)) for i in range(1, 1501))
+    db.session.add(Planet(id=1501, name='Tatooine'))
+    db.session.commit()
+    search.rebuild()
+    result = client.get('/search?q=tatooine&type=planet&limit=3').get_json()['result']
+    assert [planet['name'] for planet in result] == ['Tatooine', 'Tatooine Outpost 1', 'Tatooine Outpost 2']
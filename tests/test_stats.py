@@ -0,0 +1,106 @@
+import pytest
+
+from cache import entity_cache
+from models import db, Planet, Character
+
+
+@pytest.fixture
+def catalog(app):
+    db.session.add_all([
+        Planet(id=1, name='Tatooine', population=0),
+        Planet(id=2, name='Alderaan', population=5),
+        Planet(id=3, name='Naboo', population=10),
+        Planet(id=4, name='Hoth', population=15),
+        Planet(id=5, name='Dagobah', population=None),
+    ])
+    db.session.add_all([
+        Character(id=1, name='Luke', height=172, mass=77, planet_id=1),
+        Character(id=2, name='Anakin', height=188, mass=84, planet_id=1),
+        Character(id=3, name='Leia', height=150, mass=None, planet_id=2),
+        Character(id=4, name='Padme', height=165, mass=45, planet_id=3),
+    ])
+    db.session.commit()
+
+
+def test_planet_histogram(client, catalog):
+    result = client.get('/stats/planets?buckets=2').get_json()['result']
+    assert result == {
+        'planets': 5,
+        'population': {'count': 4, 'total': 30, 'average': 7.5, 'min': 0, 'max': 15},
+        # [0, 15] in two buckets of width 8; the planet without population isn't counted
+        'histogram': {'population': [{'from': 0, 'to': 7, 'count': 2}, {'from': 8, 'to': 15, 'count': 2}]},
+    }
+    # more buckets than values: width 1, empty buckets included
+    histogram = client.get('/stats/planets?buckets=100').get_json()['result']['histogram']['population']
+    assert len(histogram) == 16 and sum(bucket['count'] for bucket in histogram) == 4
+    assert [bucket['from'] for bucket in histogram if bucket['count']] == [0, 5, 10, 15]
+    assert 'histogram' not in client.get('/stats/planets').get_json()['result']
+
+
+def test_character_stats_per_planet(client, catalog):
+    result = client.get('/stats/characters?buckets=2').get_json()['result']
+    assert result['characters'] == 4
+    assert result['height'] == {'count': 4, 'total': 675, 'average': 168.75, 'min': 150, 'max': 188}
+    assert result['mass'] == {'count': 3, 'total': 206, 'average': 68.67, 'min': 45, 'max': 84}
+    assert result['planets'] == {'with_characters': 3, 'average_characters': 1.33}
+    assert [(row['planet'], row['characters']) for row in result['per_planet']] == [
+        ({'id': 1, 'name': 'Tatooine'}, 2), ({'id': 2, 'name': 'Alderaan'}, 1), ({'id': 3, 'name': 'Naboo'}, 1)]
+    # heights 150..188 in buckets of 20, masses 45..84 in buckets of 20
+    assert result['histogram'] == {
+        'height': [{'from': 150, 'to': 169, 'count': 2}, {'from': 170, 'to': 188, 'count': 2}],
+        'mass': [{'from': 45, 'to': 64, 'count': 1}, {'from': 65, 'to': 84, 'count': 2}],
+    }
+
+    tatooine = client.get('/stats/characters?planet_id=1&buckets=1').get_json()['result']
+    assert tatooine['characters'] == 2
+    assert tatooine['histogram']['height'] == [{'from': 172, 'to': 188, 'count': 2}]
+    assert client.get('/stats/characters?limit=1').get_json()['result']['per_planet'][0]['planet']['id'] == 1
+
+
+def test_empty_tables(client):
+    assert client.get('/stats/planets?buckets=3').get_json()['result'] == {
+        'planets': 0,
+        'population': {'count': 0, 'total': None, 'average': None, 'min': None, 'max': None},
+        'histogram': {'population': []},
+    }
+    result = client.get('/stats/characters').get_json()['result']
+    assert result['planets'] == {'with_characters': 0, 'average_characters': None}
+    assert result['per_planet'] == []
+
+
+def test_writes_invalidate_cached_stats(client, catalog):
+    first = client.get('/stats/planets?buckets=2')
+    assert first.get_json()['result']['population']['total'] == 30
+    hits = entity_cache.stats()['hits']
+    client.get('/stats/planets?buckets=2')
+    assert entity_cache.stats()['hits'] == hits + 1
+    assert client.get('/stats/planets?buckets=2', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    assert client.post('/planets', json={'name': 'Kamino', 'population': 15}).status_code == 200
+    response = client.get('/stats/planets?buckets=2', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['result']['histogram']['population'][1]['count'] == 3
+
+    assert client.put('/planet/1', json={'population': 1}).status_code == 200
+    assert client.get('/stats/planets?buckets=2').get_json()['result']['population']['min'] == 1
+
+    # character stats depend on planet names too
+    before = client.get('/stats/characters').get_json()['result']['per_planet'][0]['planet']['name']
+    assert before == 'Tatooine'
+    db.session.get(Planet, 1).name = 'Tatooine II'
+    db.session.commit()
+    assert client.get('/stats/characters').get_json()['result']['per_planet'][0]['planet']['name'] == 'Tatooine II'
+
+    assert client.delete('/character/1').status_code == 200
+    assert client.get('/stats/characters').get_json()['result']['characters'] == 3
+
+
+@pytest.mark.parametrize('query, message', [
+    ('buckets=x', 'El parámetro buckets debe ser un entero'),
+    ('buckets=0', 'El parámetro buckets debe estar entre 1 y 100'),
+    ('buckets=101', 'El parámetro buckets debe estar entre 1 y 100'),
+])
+def test_bad_buckets(client, query, message):
+    response = client.get('/stats/planets?' + query)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == message
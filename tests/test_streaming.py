@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+ROUTES = ['/user', '/planets', '/characters', '/vehicles', '/favorites/all']
+
+
+@pytest.fixture
+def small_batches(app):
+    # several yield_per batches for a dozen rows
+    batch_size = app.config['API_STREAM_BATCH_SIZE']
+    app.config['API_STREAM_BATCH_SIZE'] = 5
+    yield
+    app.config['API_STREAM_BATCH_SIZE'] = batch_size
+
+
+def pages(client, route):
+    result, after = [], None
+    while True:
+        page = client.get('{}?limit=5{}'.format(route, '&after={}'.format(after) if after else '')).get_json()
+        result.extend(page['result'])
+        after = page['next']
+        if after is None:
+            return result
+
+
+@pytest.mark.parametrize('route', ROUTES)
+def test_streamed_envelope_holds_every_page(client, seed, small_batches, route):
+    seed(12)
+    response = client.get(route + '?stream=1')
+    assert response.status_code == 200 and response.is_streamed
+    assert response.mimetype == 'application/json'
+    body = json.loads(response.get_data())
+    assert body == {'msg': 'ok', 'result': pages(client, route)}
+
+
+@pytest.mark.parametrize('route', ROUTES)
+def test_empty_stream_is_valid_json(client, route):
+    assert json.loads(client.get(route + '?stream=true').get_data()) == {'msg': 'ok', 'result': []}
+
+
+def test_stream_resumes_after_a_cursor(client, seed, small_batches):
+    seed(12)
+    result = json.loads(client.get('/planets?stream=1&after=7').get_data())['result']
+    assert [planet['id'] for planet in result] == list(range(8, 13))
+    response = client.get('/planets?stream=1&after=x')
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'El parámetro after debe ser un entero'
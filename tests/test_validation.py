@@ -0,0 +1,47 @@
+import pytest
+
+
+@pytest.mark.parametrize('path, item', [
+    ('/planets', {'name': None}),
+    ('/planets', {'name': ['a']}),
+    ('/planets', {'name': ' '}),
+    ('/planets', {'name': 'x' * 26}),
+    ('/characters', {'name': {'a': 1}, 'planet_id': 1}),
+    ('/vehicles', {'name': 'V1', 'type': {'a': 1}}),
+    ('/vehicles', {'name': 7, 'type': 'speeder'}),
+])
+def test_batch_reports_invalid_types_per_item(client, seed, path, item):
+    seed(1)
+    valid = {'/planets': {'name': 'Tatooine'}, '/characters': {'name': 'Leia', 'planet_id': 1}, '/vehicles': {'name': 'X-wing', 'type': 'starfighter'}}[path]
+    response = client.post(path, json=[item, valid])
+    assert response.status_code == 201
+    body = response.get_json()
+    assert [error['index'] for error in body['errors']] == [0]
+    assert [created['index'] for created in body['result']] == [1]
+
+
+def test_single_create_and_update_validate_types(client, seed):
+    seed(1)
+    assert client.post('/planets', json={'name': None}).status_code == 400
+    assert client.post('/vehicles', json={'name': 'V1', 'type': {'a': 1}}).status_code == 400
+    assert client.put('/planet/1', json={'name': ['a']}).status_code == 400
+    assert client.put('/character/1', json={'mass': '80'}).status_code == 400
+    assert client.put('/planet/1', json={'name': 'Alderaan'}).status_code == 200
+
+
+@pytest.mark.parametrize('planet_id, status, message, update_message', [
+    (None, 400, 'height, mass y planet_id deben ser enteros', 'planet_id debe ser un entero'),
+    (99, 404, 'El planeta 99 no existe', 'El planeta 99 no existe'),
+])
+def test_characters_need_an_existing_planet(client, seed, planet_id, status, message, update_message):
+    seed(1)
+    item = {'name': 'Han', 'planet_id': planet_id}
+    response = client.post('/characters', json=item)
+    assert (response.status_code, response.get_json()['msg']) == (status, message)
+    response = client.post('/characters', json=[item])
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'index': 0, 'msg': message}]
+    response = client.put('/character/1', json={'planet_id': planet_id})
+    assert (response.status_code, response.get_json()['msg']) == (status, update_message)
+    [character] = client.get('/characters').get_json()['result']
+    assert character['planet']['id'] == 1
@@ -0,0 +1,24 @@
+from models import db, Planet, Favorite, TableVersion
+
+
+def test_session_writes_bump_versions(client, seed):
+    # the way Flask-Admin writes: plain ORM changes, no handler involved
+    seed(3)
+    assert client.get('/planets/1').get_json()['result']['population'] == 1000
+    etag = client.get('/planets').headers['ETag']
+    assert client.get('/planets', headers={'If-None-Match': etag}).status_code == 304
+
+    db.session.get(Planet, 1).population = 42
+    db.session.commit()
+    response = client.get('/planets', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['result'][0]['population'] == 42
+    assert client.get('/planets/1').get_json()['result']['population'] == 42
+
+
+def test_bulk_statements_bump_versions(app, seed):
+    seed(3)
+    before = TableVersion.etag('favorite')
+    Favorite.query.filter(Favorite.user_id == 1).delete(synchronize_session=False)
+    db.session.commit()
+    assert TableVersion.etag('favorite') != before